@@ -1,4 +1,3 @@
-import time 
 import random
 import string
 import textwrap
@@ -9,6 +8,8 @@ from Crypto.Cipher import AES, PKCS1_OAEP
 
 import ast
 
+from encryption_module.metrics import HistogramMetrics
+
 n = 32
 
 # IMPLEMENTATION OF RSA BLOCK CIPHER WITH n-byte BLOCKS
@@ -19,12 +20,8 @@ def encrypt(message):
     cipher_rsa = PKCS1_OAEP.new(public_key)
     message = [message[i:i+n] for i in range(0, len(message), n)]
     ciphertext = list()
-    total_length = 0
     for block in message:
-        one_block = cipher_rsa.encrypt(block)
-        ciphertext.append(one_block)
-        total_length += len(one_block)
-    print("*** CIPHERTEXT LENGTH:", total_length)
+        ciphertext.append(cipher_rsa.encrypt(block))
     return ciphertext
 
 def decrypt(ciphertext):
@@ -55,14 +52,13 @@ def main():
     # f.close()
     # print("Keys generated successfully.")
 
-    start_time = time.time()
-    enc = encrypt(message)
-    finish_time = time.time()
-    print("Encryption took", finish_time - start_time, "seconds.")
-    start_time = time.time()
-    dec = decrypt(enc)
-    finish_time = time.time()
-    print("Decryption took", finish_time - start_time, "seconds.")
+    metrics = HistogramMetrics()
+    with metrics.phase("encryption"):
+        enc = encrypt(message)
+    print("*** CIPHERTEXT LENGTH:", sum(len(block) for block in enc))
+    with metrics.phase("decryption"):
+        dec = decrypt(enc)
+    print(metrics.format_summary())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,137 @@
+'''
+Equivalence check of the "legacy" encoding of EncryptionModule with the
+original character by character algorithm, which it has to reproduce
+exactly (the ciphertexts of the legacy encoding have no header, so any
+difference would make old ciphertexts undecryptable). The cases cover the
+character codes 0 and 999, codes of 1000 or more (which spill over into
+the digits of the previous character), lone surrogates, lengths around
+multiples of the block size and random messages. Run it from the
+repository root:
+
+    python -m benchmarks.legacy_encoding_check
+
+The command exits with status 1 if any case differs.
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+from encryption_module.encryption_module import EncryptionModule
+from encryption_module.ciphertext_format import CiphertextHeader
+
+def baseline_message_to_blocks(message, block_size):
+    blocks = list()
+    block_value = ord(message[0])
+    for i in range(1, len(message)):
+        if i % block_size == 0:
+            blocks.append(block_value)
+            block_value = 0
+        block_value = block_value * 1000 + ord(message[i])
+    blocks.append(block_value)
+    return blocks
+
+def baseline_blocks_to_message(blocks, block_size):
+    decrypted_message = ""
+    for block in blocks:
+        tmp = ""
+        for c in range(block_size):
+            if not block == 0:
+                tmp = chr(block % 1000) + tmp
+            block //= 1000
+        decrypted_message += tmp
+    return decrypted_message
+
+def generate_cases(block_sizes, random_count, seed):
+    '''
+    Yields (message, block size) pairs of the special and the random cases.
+    '''
+
+    rng = random.Random(seed)
+    special_characters = ["\x00", "ϧ", "Ϩ", "€", "\U0001f600", "\ud83d", "\udc00", "a"]
+    for block_size in block_sizes:
+        for length in sorted({1, 2, block_size - 1, block_size, block_size + 1, 2 * block_size, 2 * block_size + 1} - {0}):
+            yield "a" * length, block_size
+            yield "ϧ" * length, block_size
+            yield "\x00" * length, block_size
+            for character in special_characters:
+                yield "b" * (length - 1) + character, block_size
+                yield character + "c" * (length - 1), block_size
+
+    alphabets = [
+        [chr(code) for code in range(1, 1000)],
+        [chr(code) for code in range(0, 1000)],
+        [chr(code) for code in range(0, 1000)] + special_characters
+    ]
+    for i in range(random_count):
+        block_size = rng.choice(block_sizes)
+        alphabet = rng.choice(alphabets)
+        length = rng.randint(1, 4 * block_size + 3)
+        yield "".join(rng.choice(alphabet) for j in range(length)), block_size
+
+def check_equivalence(em, cases):
+    '''
+    Compares the block packing and unpacking of the module with the
+    baseline algorithm and returns the list of differing cases.
+    '''
+
+    mismatches = list()
+    for message, block_size in cases:
+        header = CiphertextHeader("ECB", "legacy", block_size, 0, 0, b"")
+        expected_blocks = baseline_message_to_blocks(message, block_size)
+        blocks = em._EncryptionModule__message_to_blocks(message, header)
+        if blocks != expected_blocks:
+            mismatches.append(("pack", message, block_size))
+            continue
+        expected_message = baseline_blocks_to_message(expected_blocks, block_size)
+        if em._EncryptionModule__blocks_to_message(list(expected_blocks), header) != expected_message:
+            mismatches.append(("unpack", message, block_size))
+    return mismatches
+
+def check_round_trip(em, block_sizes, seed):
+    '''
+    Encrypts and decrypts messages of character codes 1 to 999 (which the
+    legacy encoding preserves) in both modes and returns the differing cases.
+    '''
+
+    rng = random.Random(seed)
+    mismatches = list()
+    for mode in ["ECB", "CBC"]:
+        em.set_mode(mode)
+        for block_size in block_sizes:
+            em.set_block_size(block_size)
+            for length in [1, block_size, block_size + 1, 3 * block_size + 2]:
+                message = "".join(chr(rng.randint(1, 999)) for i in range(length))
+                if em.decrypt(em.encrypt(message)) != message:
+                    mismatches.append(("round trip " + mode, message, block_size))
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description = "Check the legacy encoding against the original algorithm.")
+    parser.add_argument("--random-cases", type = int, default = 3000, help = "number of random messages")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    working_directory = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix = "rsa_legacy_check_"))
+    try:
+        em = EncryptionModule(generate_new_keys = True)
+        block_sizes = sorted({1, 2, 3, 16, em.get_max_block_size()})
+        mismatches = check_equivalence(em, generate_cases(block_sizes, args.random_cases, args.seed))
+        mismatches += check_round_trip(em, block_sizes, args.seed)
+        em.close()
+    finally:
+        os.chdir(working_directory)
+
+    for kind, message, block_size in mismatches[:20]:
+        print("[ERROR]", kind, "differs for block size", block_size, "and message", ascii(message[:40]))
+    if len(mismatches) > 0:
+        print("[ERROR]", len(mismatches), "cases differ from the original algorithm.")
+        return 1
+    print("[INFO] The legacy encoding matches the original algorithm.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
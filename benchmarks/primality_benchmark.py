@@ -0,0 +1,42 @@
+import argparse
+import random
+import time
+
+from encryption_module.math_module import MathModule
+
+def benchmark_primality_test(primality_test, bits, primes_count, seed, backend = "python"):
+    '''
+    Generates primes_count primes of the given bit length with the chosen
+    primality test and arithmetic backend and returns the total time and the
+    prime search counters. The random generator is seeded, so that the runs
+    are reproducible.
+    '''
+
+    mm = MathModule(primality_test = primality_test, backend = backend)
+    random.seed(seed)
+    start_time = time.perf_counter()
+    for i in range(primes_count):
+        mm.generate_large_prime(bits)
+    finish_time = time.perf_counter()
+    return finish_time - start_time, mm.get_prime_search_stats()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compare the primality tests of MathModule.")
+    parser.add_argument("--bits", type = int, default = 1024, help = "bit length of the generated primes")
+    parser.add_argument("--count", type = int, default = 10, help = "number of primes generated with every test")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--backend", choices = MathModule.BACKENDS, default = "python", help = "arithmetic backend of MathModule")
+    args = parser.parse_args()
+
+    results = dict()
+    for primality_test in MathModule.PRIMALITY_TESTS:
+        elapsed, stats = benchmark_primality_test(primality_test, args.bits, args.count, args.seed, args.backend)
+        results[primality_test] = elapsed
+        print(primality_test.ljust(14), "%.3f s" % elapsed, "(%.1f ms per prime)" % (1000 * elapsed / args.count), stats)
+
+    for primality_test in MathModule.PRIMALITY_TESTS:
+        if primality_test != "legacy":
+            print(primality_test, "speedup over legacy: %.2fx" % (results["legacy"] / results[primality_test]))
+
+if __name__ == "__main__":
+    main()
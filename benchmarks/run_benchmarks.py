@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+from encryption_module.encryption_module import EncryptionModule
+from encryption_module.math_module import MathModule
+from encryption_module.session_cipher import SessionCipher
+
+from .primality_benchmark import benchmark_primality_test
+
+def measure(function, repeat):
+    '''
+    Calls the function repeat times and returns the timings in seconds.
+    '''
+
+    timings = list()
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        finish_time = time.perf_counter()
+        timings.append(finish_time - start_time)
+    return timings
+
+def summarize(timings, **extra):
+    result = {
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "max": max(timings),
+        "repeat": len(timings)
+    }
+    result.update(extra)
+    if "bytes" in result and result["median"] > 0:
+        result["mb_per_s"] = result["bytes"] / result["median"] / 1e6
+    return result
+
+def random_message(length, seed):
+    generator = random.Random(seed)
+    return "".join(generator.choice(string.ascii_lowercase) for i in range(length))
+
+def benchmark_encryption_module(results, args):
+    '''
+    Encryption and decryption with EncryptionModule in both modes of
+    operation, for both encodings, a few block sizes and message lengths.
+    '''
+
+    em = EncryptionModule(generate_new_keys = True)
+    em.set_output_format("binary")
+    for encoding in ["legacy", "bytes"]:
+        em.set_encoding(encoding)
+        max_block_size = em.get_max_block_size()
+        block_sizes = [16, max_block_size]
+        for block_size in block_sizes:
+            em.set_block_size(block_size)
+            for mode in ["ECB", "CBC"]:
+                em.set_mode(mode)
+                for length in args.message_lengths:
+                    message = random_message(length, args.seed)
+                    ciphertext = em.encrypt(message)
+                    name = "encryption_module/%s/%s/block_%d/len_%d" % (mode, encoding, block_size, length)
+                    timings = measure(lambda: em.encrypt(message), args.repeat)
+                    results[name + "/encrypt"] = summarize(timings, bytes = length)
+                    timings = measure(lambda: em.decrypt(ciphertext), args.repeat)
+                    results[name + "/decrypt"] = summarize(timings, bytes = length)
+    em.close()
+
+def benchmark_hybrid_mode(results, args):
+    '''
+    Throughput of the hybrid mode (RSA encrypted session key and the payload
+    encrypted with a session cipher) for every session cipher (skipped if
+    PyCryptodome is not installed).
+    '''
+
+    if not SessionCipher.is_available(SessionCipher.get_default_cipher()):
+        print("[INFO] PyCryptodome is not installed, skipping the hybrid mode.")
+        return
+
+    em = EncryptionModule(generate_new_keys = True)
+    em.set_output_format("binary")
+    em.set_mode("HYBRID")
+    for cipher in SessionCipher.CIPHERS:
+        em.set_session_cipher(cipher)
+        for length in args.payload_lengths:
+            message = random_message(length, args.seed)
+            ciphertext = em.encrypt(message)
+            name = "hybrid/%s/len_%d" % (cipher, length)
+            timings = measure(lambda: em.encrypt(message), args.repeat)
+            results[name + "/encrypt"] = summarize(timings, bytes = length)
+            timings = measure(lambda: em.decrypt(ciphertext), args.repeat)
+            results[name + "/decrypt"] = summarize(timings, bytes = length)
+    em.close()
+
+def benchmark_math_module(results, args):
+    '''
+    Prime generation with every primality test, testing known primes
+    (the worst case of a probabilistic test, since all of the rounds run)
+    and the modular exponentiation of RSA keys, with every available
+    arithmetic backend.
+    '''
+
+    random.seed(args.seed)
+    primes = MathModule().generate_large_primes(args.prime_bits, args.primes_count)
+    key_pairs = [MathModule().generate_rsa_key_pair(bits // 2) for bits in args.modulus_bits]
+
+    for backend in MathModule.BACKENDS:
+        if not MathModule.is_backend_available(backend):
+            print("[INFO] Arithmetic backend", backend, "is not available, skipping it.")
+            continue
+
+        for primality_test in MathModule.PRIMALITY_TESTS:
+            timings = list()
+            for i in range(args.repeat):
+                elapsed, stats = benchmark_primality_test(primality_test, args.prime_bits, args.primes_count, args.seed + i, backend)
+                timings.append(elapsed / args.primes_count)
+            results["math_module/%s/generate_large_prime/%s/bits_%d" % (backend, primality_test, args.prime_bits)] = summarize(timings)
+
+        for primality_test in MathModule.PRIMALITY_TESTS:
+            mm = MathModule(primality_test = primality_test, backend = backend)
+            timings = measure(lambda: [mm.is_probable_prime(prime) for prime in primes], args.repeat)
+            timings = [timing / len(primes) for timing in timings]
+            results["math_module/%s/is_probable_prime/%s/bits_%d" % (backend, primality_test, args.prime_bits)] = summarize(timings)
+
+        powmod = MathModule.get_powmod(backend)
+        for bits, (public_key, private_key) in zip(args.modulus_bits, key_pairs):
+            n, e = public_key
+            value = random.randrange(2, n)
+            timings = measure(lambda: powmod(value, e, n), args.repeat)
+            results["math_module/%s/encrypt_pow/bits_%d" % (backend, bits)] = summarize(timings)
+            timings = measure(lambda: MathModule.private_pow(value, private_key, backend), args.repeat)
+            results["math_module/%s/private_pow/bits_%d" % (backend, bits)] = summarize(timings)
+
+def benchmark_pycryptodome(results, args):
+    '''
+    The PKCS #1 OAEP baseline from RSA_crypto.py (skipped if PyCryptodome
+    is not installed). The script reads its keys from ./data.
+    '''
+
+    try:
+        from Crypto.PublicKey import RSA
+        import RSA_crypto
+    except ImportError:
+        print("[INFO] PyCryptodome is not installed, skipping the OAEP baseline.")
+        return
+
+    key = RSA.generate(2048)
+    with open("./data/private.pem", "wb") as file:
+        file.write(key.export_key("PEM"))
+    with open("./data/public.pem", "wb") as file:
+        file.write(key.publickey().export_key("PEM"))
+
+    for length in args.message_lengths:
+        message = random_message(length, args.seed).encode("utf-8")
+        ciphertext = RSA_crypto.encrypt(message)
+        timings = measure(lambda: RSA_crypto.encrypt(message), args.repeat)
+        results["pycryptodome_oaep/len_%d/encrypt" % length] = summarize(timings, bytes = length)
+        timings = measure(lambda: RSA_crypto.decrypt(ciphertext), args.repeat)
+        results["pycryptodome_oaep/len_%d/decrypt" % length] = summarize(timings, bytes = length)
+
+def compare_with_baseline(results, baseline, threshold):
+    '''
+    Returns the list of (name, baseline median, current median) of the
+    benchmarks whose median is slower than the baseline by more than the
+    threshold (0.2 means 20% slower).
+    '''
+
+    regressions = list()
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        baseline_median = baseline[name]["median"]
+        if result["median"] > baseline_median * (1 + threshold):
+            regressions.append((name, baseline_median, result["median"]))
+    return regressions
+
+BENCHMARKS = {
+    "encryption": benchmark_encryption_module,
+    "hybrid": benchmark_hybrid_mode,
+    "math": benchmark_math_module,
+    "pycryptodome": benchmark_pycryptodome
+}
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run the benchmark suite of the RSA message encoder.")
+    parser.add_argument("--only", nargs = "+", choices = sorted(BENCHMARKS), default = sorted(BENCHMARKS), help = "groups of benchmarks to run")
+    parser.add_argument("--output", default = "bench_output.json", help = "file the JSON results are written to")
+    parser.add_argument("--baseline", help = "JSON results of a previous run to compare with")
+    parser.add_argument("--threshold", type = float, default = 0.2, help = "allowed slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument("--repeat", type = int, default = 5, help = "number of timed runs of every benchmark")
+    parser.add_argument("--message-lengths", type = int, nargs = "+", default = [64, 4096])
+    parser.add_argument("--payload-lengths", type = int, nargs = "+", default = [1 << 20, 16 << 20], help = "message lengths of the hybrid mode benchmarks")
+    parser.add_argument("--prime-bits", type = int, default = 1024)
+    parser.add_argument("--primes-count", type = int, default = 5)
+    parser.add_argument("--modulus-bits", type = int, nargs = "+", default = [2048, 4096], help = "key sizes of the modular exponentiation benchmarks")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)["results"]
+
+    # The modules keep their keys in ./data, so the benchmarks run in a
+    # temporary directory with keys generated from a seeded random generator
+    working_directory = os.getcwd()
+    sys.path.insert(0, working_directory)
+    os.chdir(tempfile.mkdtemp(prefix = "rsa_benchmarks_"))
+    os.mkdir("./data")
+    random.seed(args.seed)
+
+    results = dict()
+    try:
+        for group in args.only:
+            print("[INFO] Running the", group, "benchmarks...")
+            BENCHMARKS[group](results, args)
+    finally:
+        os.chdir(working_directory)
+
+    report = {
+        "python": sys.version,
+        "arguments": vars(args),
+        "results": results
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent = 2)
+
+    for name in sorted(results):
+        throughput = ""
+        if "mb_per_s" in results[name]:
+            throughput = "%10.2f MB/s" % results[name]["mb_per_s"]
+        print(name.ljust(70), "%.6f s" % results[name]["median"], throughput)
+    print("[INFO] Results written to", output)
+
+    if baseline is not None:
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        for name, baseline_median, median in regressions:
+            print("[REGRESSION]", name, "%.6f s -> %.6f s" % (baseline_median, median))
+        if len(regressions) > 0:
+            return 1
+        print("[INFO] No regressions against", args.baseline)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import sys
+import json
+import socket
+import argparse
+import itertools
+
+DEFAULT_SOCKET_PATH = "./data/encryption_daemon.sock"
+MAX_LINE_LENGTH = 64 * 1024 * 1024  # longest request or response line, in bytes
+
+class EncryptionDaemonError(Exception):
+    '''
+    Raised for an error reported by the daemon, other than a ValueError
+    (which is raised as it is, like by the EncryptionModule).
+    '''
+
+class EncryptionDaemonClient:
+    '''
+    Client of the encryption daemon (see encryption_daemon.py). It uses only
+    the standard library, so that short-lived programs do not pay for importing
+    and constructing the EncryptionModule. The requests and responses are JSON
+    objects, one per line: {"id": ..., "op": ..., ...} is answered with
+    {"id": ..., "ok": true, "result": ...} or {"id": ..., "ok": false,
+    "error": ..., "error_type": ...}. The requests sent together by the _many
+    methods are processed concurrently by the daemon (and batched there).
+    '''
+
+    def __init__(self, socket_path = DEFAULT_SOCKET_PATH, timeout = None):
+        self.__socket_path = socket_path
+        self.__timeout = timeout
+        self.__socket = None
+        self.__file = None
+        self.__ids = itertools.count(1)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def connect(self):
+        if self.__socket is not None:
+            return
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.settimeout(self.__timeout)
+        try:
+            self.__socket.connect(self.__socket_path)
+        except OSError:
+            self.__socket.close()
+            self.__socket = None
+            raise
+        self.__file = self.__socket.makefile("rwb")
+
+    def close(self):
+        if self.__socket is None:
+            return
+        self.__file.close()
+        self.__socket.close()
+        self.__file = None
+        self.__socket = None
+
+    def encrypt(self, message):
+        return self.__request([{"op": "encrypt", "message": message}])[0]
+
+    def decrypt(self, ciphertext):
+        return self.__request([{"op": "decrypt", "ciphertext": ciphertext}])[0]
+
+    def encrypt_many(self, messages):
+        return self.__request([{"op": "encrypt", "message": message} for message in messages])
+
+    def decrypt_many(self, ciphertexts):
+        return self.__request([{"op": "decrypt", "ciphertext": ciphertext} for ciphertext in ciphertexts])
+
+    def get_stats(self):
+        return self.__request([{"op": "stats"}])[0]
+
+    def ping(self):
+        return self.__request([{"op": "ping"}])[0]
+
+    def shutdown(self):
+        '''
+        This method asks the daemon to finish the requests in progress and stop.
+        '''
+
+        return self.__request([{"op": "shutdown"}])[0]
+
+    def __request(self, requests):
+        '''
+        This method sends all of the requests at once and returns their
+        results in the same order. The first failed request raises
+        its error (after all of the responses were read).
+        '''
+
+        self.connect()
+        ids = list()
+        for request in requests:
+            request["id"] = next(self.__ids)
+            ids.append(request["id"])
+            self.__file.write(json.dumps(request).encode("utf-8") + b"\n")
+        self.__file.flush()
+
+        responses = dict()
+        while len(responses) < len(ids):
+            line = self.__file.readline(MAX_LINE_LENGTH + 1)
+            if len(line) == 0:
+                self.close()
+                raise EncryptionDaemonError("Connection closed by the daemon.")
+            response = json.loads(line)
+            responses[response.get("id")] = response
+
+        results = list()
+        for request_id in ids:
+            response = responses[request_id]
+            if not response["ok"]:
+                if response.get("error_type") == "ValueError":
+                    raise ValueError(response["error"])
+                raise EncryptionDaemonError(response.get("error_type", "Error") + ": " + response["error"])
+            results.append(response["result"])
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description = "Send a request to the encryption daemon.")
+    parser.add_argument("operation", choices = ["encrypt", "decrypt", "stats", "ping", "shutdown"])
+    parser.add_argument("text", nargs = "?", help = "message or ciphertext (read from the standard input if it is not given)")
+    parser.add_argument("--socket", default = DEFAULT_SOCKET_PATH, help = "path of the daemon's Unix socket")
+    args = parser.parse_args()
+
+    with EncryptionDaemonClient(args.socket) as client:
+        if args.operation in ("encrypt", "decrypt"):
+            text = args.text if args.text is not None else sys.stdin.read()
+            if args.operation == "encrypt":
+                print(client.encrypt(text))
+            else:
+                print(client.decrypt(text))
+        elif args.operation == "stats":
+            print(json.dumps(client.get_stats(), indent = 2))
+        elif args.operation == "ping":
+            print(client.ping())
+        else:
+            client.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+
+from encryption_module.encryption_module import EncryptionModule
+from encryption_module.async_encryption_module import AsyncEncryptionModule
+from encryption_module.metrics import HistogramMetrics
+from daemon_module.daemon_client import DEFAULT_SOCKET_PATH, MAX_LINE_LENGTH
+
+class EncryptionDaemon:
+    '''
+    Long-running local daemon serving encryption and decryption requests on
+    a Unix socket (see EncryptionDaemonClient for the protocol). The module
+    is constructed, its keys are loaded and its worker pool is started only
+    once, when the daemon starts. The small requests arriving at the same time
+    (from any connections) are batched by an AsyncEncryptionModule, so that
+    their blocks are exponentiated in one job. On SIGINT, SIGTERM or a
+    "shutdown" request the daemon stops accepting requests, finishes the ones
+    in progress and removes its socket.
+    '''
+
+    def __init__(self, encryption_module, socket_path = DEFAULT_SOCKET_PATH, max_concurrency = 4, batch_delay = 0.002, shutdown_timeout = 30.0):
+        self.__em = encryption_module
+        # Ciphertexts are sent in JSON strings
+        if self.__em.get_output_format() == "binary":
+            self.__em.set_output_format("armored")
+        self.__aem = AsyncEncryptionModule(self.__em, max_concurrency = max_concurrency, batch_delay = batch_delay)
+        self.__socket_path = socket_path
+        self.__shutdown_timeout = shutdown_timeout
+
+        # Created in the event loop by serve
+        self.__server = None
+        self.__stop_event = None
+        self.__writers = set()
+        self.__request_tasks = set()
+
+        self.__start_time = None
+        self.__stats = {
+            "connections": 0,
+            "requests": 0,
+            "completed": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "bytes_received": 0,
+            "bytes_sent": 0,
+            "total_latency": 0.0
+        }
+
+    def get_stats(self):
+        '''
+        This method returns the counters of the daemon, its throughput
+        since the start, the queue depth (requests received but not
+        answered yet) and the batching statistics of the requests.
+        '''
+
+        stats = dict(self.__stats)
+        uptime = time.perf_counter() - self.__start_time if self.__start_time is not None else 0.0
+        stats["uptime"] = uptime
+        stats["queue_depth"] = self.__stats["in_flight"]
+        stats["requests_per_second"] = self.__stats["completed"] / uptime if uptime > 0 else 0.0
+        stats["bytes_per_second"] = (self.__stats["bytes_received"] + self.__stats["bytes_sent"]) / uptime if uptime > 0 else 0.0
+        stats["average_latency"] = self.__stats["total_latency"] / self.__stats["completed"] if self.__stats["completed"] > 0 else 0.0
+        stats["batching"] = self.__aem.get_stats()
+
+        collector = self.__em.get_metrics()
+        if hasattr(collector, "get_summary"):
+            stats["phases"] = collector.get_summary()
+        return stats
+
+    def stop(self):
+        if self.__stop_event is not None:
+            self.__stop_event.set()
+
+    async def serve(self):
+        '''
+        This method warms up the module, listens on the socket until
+        the daemon is stopped and then shuts it down.
+        '''
+
+        self.__stop_event = asyncio.Event()
+        self.__remove_stale_socket()
+
+        # Loading the keys and starting the worker pool before the first request
+        await asyncio.get_running_loop().run_in_executor(None, self.__warm_up)
+
+        self.__server = await asyncio.start_unix_server(self.__handle_connection, path = self.__socket_path, limit = MAX_LINE_LENGTH)
+        self.__start_time = time.perf_counter()
+        signals = self.__add_signal_handlers()
+        print("[INFO] Encryption daemon listening on " + self.__socket_path)
+
+        try:
+            await self.__stop_event.wait()
+        finally:
+            for signal_number in signals:
+                asyncio.get_running_loop().remove_signal_handler(signal_number)
+            await self.__shutdown()
+
+    def __warm_up(self):
+        self.__em.decrypt(self.__em.encrypt("warm-up"))
+
+    def __remove_stale_socket(self):
+        '''
+        This method removes the socket file left by a daemon which did not shut
+        down cleanly. A RuntimeError is raised if a daemon is still listening.
+        '''
+
+        if not os.path.exists(self.__socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.__socket_path)
+        except OSError:
+            os.remove(self.__socket_path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError("An encryption daemon is already listening on " + self.__socket_path)
+
+    def __add_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        signals = list()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Signal handlers can be set only in the main thread
+                continue
+            signals.append(signal_number)
+        return signals
+
+    async def __shutdown(self):
+        print("[INFO] Shutting down the encryption daemon")
+        self.__server.close()
+
+        if len(self.__request_tasks) > 0:
+            done, pending = await asyncio.wait(set(self.__request_tasks), timeout = self.__shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            if len(pending) > 0:
+                await asyncio.wait(pending)
+        await self.__aem.flush()
+
+        for writer in list(self.__writers):
+            writer.close()
+        await self.__server.wait_closed()
+
+        if os.path.exists(self.__socket_path):
+            os.remove(self.__socket_path)
+        await asyncio.get_running_loop().run_in_executor(None, self.__em.close)
+
+    async def __handle_connection(self, reader, writer):
+        self.__stats["connections"] += 1
+        self.__writers.add(writer)
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while not self.__stop_event.is_set():
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError) as error:
+                    # The line is longer than the limit or the client is gone
+                    print("[ERROR]", error)
+                    break
+                if len(line) == 0:
+                    break
+                if self.__stop_event.is_set():
+                    break
+
+                # The requests are processed concurrently, the responses
+                # are written in the order in which they are finished
+                task = asyncio.ensure_future(self.__handle_request(line, writer, write_lock))
+                for task_set in (tasks, self.__request_tasks):
+                    task_set.add(task)
+                    task.add_done_callback(task_set.discard)
+            if len(tasks) > 0:
+                await asyncio.wait(set(tasks))
+        finally:
+            self.__writers.discard(writer)
+            writer.close()
+
+    async def __handle_request(self, line, writer, write_lock):
+        start_time = time.perf_counter()
+        self.__stats["requests"] += 1
+        self.__stats["in_flight"] += 1
+        self.__stats["bytes_received"] += len(line)
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request has to be a JSON object.")
+            request_id = request.get("id")
+            result = await self.__dispatch(request)
+            response = {"id": request_id, "ok": True, "result": result}
+        except asyncio.CancelledError:
+            response = {"id": request_id, "ok": False, "error": "Daemon is shutting down.", "error_type": "CancelledError"}
+        except Exception as error:
+            self.__stats["errors"] += 1
+            response = {"id": request_id, "ok": False, "error": str(error), "error_type": type(error).__name__}
+        finally:
+            self.__stats["in_flight"] -= 1
+
+        data = json.dumps(response).encode("utf-8") + b"\n"
+        try:
+            async with write_lock:
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError as error:
+            print("[ERROR]", error)
+            return
+        self.__stats["completed"] += 1
+        self.__stats["bytes_sent"] += len(data)
+        self.__stats["total_latency"] += time.perf_counter() - start_time
+
+    async def __dispatch(self, request):
+        operation = request.get("op")
+        if operation == "encrypt":
+            return await self.__aem.encrypt(self.__get_text(request, "message"))
+        if operation == "decrypt":
+            return await self.__aem.decrypt(self.__get_text(request, "ciphertext"))
+        if operation == "stats":
+            return self.get_stats()
+        if operation == "ping":
+            return "pong"
+        if operation == "shutdown":
+            self.stop()
+            return True
+        raise ValueError("Unknown operation: " + str(operation))
+
+    def __get_text(self, request, field):
+        text = request.get(field)
+        if not isinstance(text, str):
+            raise ValueError("Request field " + field + " has to be a string.")
+        return text
+
+def main():
+    parser = argparse.ArgumentParser(description = "Serve encryption and decryption requests on a Unix socket.")
+    parser.add_argument("--socket", default = DEFAULT_SOCKET_PATH, help = "path of the Unix socket")
+    parser.add_argument("--mode", default = "ECB", choices = ["ECB", "CBC", "HYBRID"], help = "mode of operation")
+    parser.add_argument("--encoding", default = "legacy", choices = ["legacy", "bytes"], help = "encoding of the messages")
+    parser.add_argument("--output-format", default = "armored", choices = ["decimal", "armored"], help = "format of the ciphertexts")
+    parser.add_argument("--workers", type = int, default = 1, help = "number of worker processes exponentiating the blocks")
+    parser.add_argument("--max-concurrency", type = int, default = 4, help = "maximum number of operations running at the same time")
+    parser.add_argument("--batch-delay", type = float, default = 0.002, help = "seconds for which small requests are collected into a batch")
+    parser.add_argument("--generate-new-keys", action = "store_true", help = "generate a new pair of keys at the start")
+    args = parser.parse_args()
+
+    em = EncryptionModule(mode = args.mode, generate_new_keys = args.generate_new_keys, workers = args.workers)
+    em.set_encoding(args.encoding)
+    em.set_output_format(args.output_format)
+    em.set_metrics(HistogramMetrics())
+
+    daemon = EncryptionDaemon(em, args.socket, max_concurrency = args.max_concurrency, batch_delay = args.batch_delay)
+    asyncio.run(daemon.serve())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import os
+import asyncio
+import threading
+import concurrent.futures
+
+from .encryption_module import OperationCancelledError
+
+# Executor shared by all of the AsyncEncryptionModule instances
+# which were not given their own one (created on first use)
+_shared_executor = None
+_shared_executor_lock = threading.Lock()
+
+def _get_shared_executor():
+    global _shared_executor
+    with _shared_executor_lock:
+        if _shared_executor is None:
+            _shared_executor = concurrent.futures.ThreadPoolExecutor(max_workers = os.cpu_count() or 1, thread_name_prefix = "encryption")
+        return _shared_executor
+
+class AsyncEncryptionModule:
+    '''
+    asyncio facade over an EncryptionModule. The encryption and decryption run
+    in an executor (the shared thread pool by default), so they do not block
+    the event loop, and at most max_concurrency executor calls are running
+    at the same time. Messages and ciphertexts of at most small_length
+    characters (bytes) are not sent to the executor one by one: the requests
+    arriving within batch_delay seconds are grouped (up to max_batch_size of
+    them) into one call of encrypt_many or decrypt_many. A cancelled request
+    stops its operation at the next progress report. The settings of the
+    wrapped module should not be changed while any request is pending.
+    '''
+
+    def __init__(self, encryption_module, executor = None, max_concurrency = 4, small_length = 1024, max_batch_size = 64, batch_delay = 0.002):
+        if not isinstance(max_concurrency, int) or max_concurrency < 1:
+            raise ValueError("Maximum concurrency has to be a positive integer.")
+        if not isinstance(max_batch_size, int) or max_batch_size < 1:
+            raise ValueError("Maximum batch size has to be a positive integer.")
+
+        self.__em = encryption_module
+        self.__executor = executor
+        self.__max_concurrency = max_concurrency
+        self.__small_length = small_length
+        self.__max_batch_size = max_batch_size
+        self.__batch_delay = batch_delay
+
+        # The semaphore is created in the event loop, on first use
+        self.__semaphore = None
+        self.__batches = {"encrypt": list(), "decrypt": list()}   # operation -> [(item, future)]
+        self.__flush_handles = {"encrypt": None, "decrypt": None}
+        self.__batch_tasks = set()
+        self.__stats = {
+            "requests": 0,
+            "batched_requests": 0,
+            "batches": 0,
+            "executor_calls": 0,
+            "cancelled": 0
+        }
+
+    def get_encryption_module(self):
+        return self.__em
+
+    def get_stats(self):
+        '''
+        This method returns the number of requests, the number of them
+        that were batched, the number of batches, the number of executor
+        calls and the number of cancelled requests.
+        '''
+
+        return dict(self.__stats)
+
+    async def encrypt(self, message):
+        '''
+        This method encrypts a message like EncryptionModule.encrypt.
+        '''
+
+        self.__stats["requests"] += 1
+        if len(message) <= self.__small_length:
+            return await self.__add_to_batch("encrypt", message)
+        return await self.__run(self.__em.encrypt, message)
+
+    async def decrypt(self, ciphertext):
+        '''
+        This method decrypts a ciphertext like EncryptionModule.decrypt.
+        '''
+
+        self.__stats["requests"] += 1
+        if len(ciphertext) <= self.__small_length:
+            return await self.__add_to_batch("decrypt", ciphertext)
+        return await self.__run(self.__em.decrypt, ciphertext)
+
+    async def flush(self):
+        '''
+        This method sends the waiting small requests to the executor
+        right away and waits until all of the batches are done.
+        '''
+
+        for operation in self.__batches:
+            self.__flush(operation)
+        if len(self.__batch_tasks) > 0:
+            await asyncio.wait(set(self.__batch_tasks))
+
+    async def __run(self, function, argument):
+        '''
+        This method runs function(argument, progress) in the executor.
+        If the awaiting task is cancelled, the progress callback stops the
+        operation and the slot of the executor is held until it has stopped.
+        '''
+
+        cancel_event = threading.Event()
+
+        def progress(done, total):
+            if cancel_event.is_set():
+                raise OperationCancelledError()
+
+        async with self.__get_semaphore():
+            self.__stats["executor_calls"] += 1
+            future = asyncio.get_running_loop().run_in_executor(self.__get_executor(), function, argument, progress)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                self.__stats["cancelled"] += 1
+                cancel_event.set()
+                await asyncio.wait([future])
+                if not future.cancelled():
+                    # Retrieve the OperationCancelledError, nobody is waiting for it
+                    future.exception()
+                raise
+
+    async def __add_to_batch(self, operation, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.__batches[operation]
+        batch.append((item, future))
+        self.__stats["batched_requests"] += 1
+
+        if len(batch) >= self.__max_batch_size:
+            self.__flush(operation)
+        elif self.__flush_handles[operation] is None:
+            self.__flush_handles[operation] = loop.call_later(self.__batch_delay, self.__flush, operation)
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            self.__stats["cancelled"] += 1
+            raise
+
+    def __flush(self, operation):
+        '''
+        This method sends the waiting requests of an operation to the
+        executor as one batch (the cancelled ones are dropped).
+        '''
+
+        handle = self.__flush_handles[operation]
+        if handle is not None:
+            handle.cancel()
+            self.__flush_handles[operation] = None
+
+        batch = [(item, future) for item, future in self.__batches[operation] if not future.cancelled()]
+        self.__batches[operation] = list()
+        if len(batch) == 0:
+            return
+
+        task = asyncio.ensure_future(self.__run_batch(operation, batch))
+        self.__batch_tasks.add(task)
+        task.add_done_callback(self.__batch_tasks.discard)
+
+    async def __run_batch(self, operation, batch):
+        items = [item for item, future in batch]
+        try:
+            async with self.__get_semaphore():
+                self.__stats["batches"] += 1
+                self.__stats["executor_calls"] += 1
+                results = await asyncio.get_running_loop().run_in_executor(self.__get_executor(), self.__process_batch, operation, items)
+        except BaseException as error:
+            for item, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            if isinstance(error, asyncio.CancelledError):
+                raise
+            return
+
+        for (item, future), (error, result) in zip(batch, results):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def __process_batch(self, operation, items):
+        '''
+        This method processes a batch in the executor and returns the list
+        of (error, result) pairs. A single invalid item makes the whole batch
+        fail, so then the items are processed again one by one, to report
+        the error only for the items which caused it.
+        '''
+
+        if operation == "encrypt":
+            process_many, process_one = self.__em.encrypt_many, self.__em.encrypt
+        else:
+            process_many, process_one = self.__em.decrypt_many, self.__em.decrypt
+
+        try:
+            return [(None, result) for result in process_many(items)]
+        except Exception:
+            pass
+
+        results = list()
+        for item in items:
+            try:
+                results.append((None, process_one(item)))
+            except Exception as error:
+                results.append((error, None))
+        return results
+
+    def __get_semaphore(self):
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.__max_concurrency)
+        return self.__semaphore
+
+    def __get_executor(self):
+        if self.__executor is None:
+            return _get_shared_executor()
+        return self.__executor
@@ -0,0 +1,187 @@
+import base64
+import hashlib
+import struct
+
+from .session_cipher import SessionCipher
+
+class CiphertextHeader:
+    '''
+    Parameters needed to decrypt a ciphertext: the mode of operation,
+    the encoding and size of the message blocks, the initialization
+    vector, the byte length of the modulus and the fingerprint of the key.
+    '''
+
+    def __init__(self, mode, encoding, block_size, iv, modulus_length, fingerprint):
+        self.mode = mode
+        self.encoding = encoding
+        self.block_size = block_size
+        self.iv = iv
+        self.modulus_length = modulus_length
+        self.fingerprint = fingerprint
+
+class CiphertextFormat:
+    '''
+    Versioned binary ciphertext format:
+    1) magic bytes b"RSAM" and the format version (1 byte),
+    2) mode of operation and encoding (1 byte each),
+    3) block size, modulus length and IV length (2 bytes each, big-endian),
+    4) the IV and the 8 byte fingerprint of the key,
+    5) the ciphertext blocks, each one being a big-endian integer
+       written on exactly modulus length bytes.
+    In the hybrid mode the header is followed instead by the session
+    section: the session cipher and the nonce length (1 byte each), the
+    nonce and the RSA encrypted session key (modulus length bytes), and
+    then by the payload encrypted with the session cipher and its tag.
+    The armored variant is the same data encoded in base64 and wrapped
+    in BEGIN/END lines, so that it can be pasted into a text box.
+    '''
+
+    MAGIC = b"RSAM"
+    VERSION = 1
+    FINGERPRINT_LENGTH = 8
+    ARMOR_BEGIN = "-----BEGIN RSA MESSAGE-----"
+    ARMOR_END = "-----END RSA MESSAGE-----"
+    ARMOR_LINE_LENGTH = 64
+
+    __MODES = ["ECB", "CBC", "HYBRID"]
+    __ENCODINGS = ["legacy", "bytes"]
+    __HEADER_STRUCT = struct.Struct(">4sBBBHHH")
+    __SESSION_STRUCT = struct.Struct(">BB")
+
+    @staticmethod
+    def calculate_fingerprint(n):
+        '''
+        This method returns the fingerprint of a key, which is the
+        beginning of the SHA-256 hash of its modulus n.
+        '''
+
+        n_bytes = n.to_bytes((n.bit_length() + 7) // 8, "big")
+        return hashlib.sha256(n_bytes).digest()[:CiphertextFormat.FINGERPRINT_LENGTH]
+
+    def pack_header(self, header):
+        iv_length = (header.iv.bit_length() + 7) // 8
+        return self.__HEADER_STRUCT.pack(
+            self.MAGIC,
+            self.VERSION,
+            self.__MODES.index(header.mode),
+            self.__ENCODINGS.index(header.encoding),
+            header.block_size,
+            header.modulus_length,
+            iv_length
+        ) + header.iv.to_bytes(iv_length, "big") + header.fingerprint
+
+    def unpack_header(self, data):
+        '''
+        This method reads the header from the beginning of the data
+        and returns it together with the length of the header in bytes.
+        '''
+
+        if len(data) < self.__HEADER_STRUCT.size:
+            raise ValueError("Ciphertext is too short.")
+        magic, version, mode, encoding, block_size, modulus_length, iv_length = self.__HEADER_STRUCT.unpack_from(data)
+        if magic != self.MAGIC:
+            raise ValueError("Not a binary ciphertext.")
+        if version != self.VERSION:
+            raise ValueError("Unsupported ciphertext format version: " + str(version))
+        if mode >= len(self.__MODES) or encoding >= len(self.__ENCODINGS):
+            raise ValueError("Invalid ciphertext header.")
+
+        offset = self.__HEADER_STRUCT.size
+        header_length = offset + iv_length + self.FINGERPRINT_LENGTH
+        if len(data) < header_length:
+            raise ValueError("Ciphertext is too short.")
+        iv = int.from_bytes(data[offset:offset + iv_length], "big")
+        fingerprint = bytes(data[offset + iv_length:header_length])
+
+        header = CiphertextHeader(self.__MODES[mode], self.__ENCODINGS[encoding], block_size, iv, modulus_length, fingerprint)
+        return header, header_length
+
+    def read_header(self, reader):
+        '''
+        This method reads only the header from a file-like object
+        opened in binary mode, leaving it at the first block.
+        '''
+
+        data = reader.read(self.__HEADER_STRUCT.size)
+        if len(data) < self.__HEADER_STRUCT.size:
+            raise ValueError("Ciphertext is too short.")
+        iv_length = self.__HEADER_STRUCT.unpack(data)[-1]
+        data += reader.read(iv_length + self.FINGERPRINT_LENGTH)
+        header, header_length = self.unpack_header(data)
+        return header
+
+    def pack(self, header, blocks):
+        '''
+        This method returns the binary ciphertext made of
+        the header and the fixed-width ciphertext blocks.
+        '''
+
+        width = header.modulus_length
+        return self.pack_header(header) + b"".join(block.to_bytes(width, "big") for block in blocks)
+
+    def unpack(self, data):
+        '''
+        This method returns the header and the list
+        of integer blocks of a binary ciphertext.
+        '''
+
+        header, offset = self.unpack_header(data)
+        width = header.modulus_length
+        if width == 0 or (len(data) - offset) % width != 0:
+            raise ValueError("Ciphertext is truncated.")
+        blocks = [int.from_bytes(data[i:i + width], "big") for i in range(offset, len(data), width)]
+        return header, blocks
+
+    def pack_session(self, cipher, nonce, encrypted_key, width):
+        return self.__SESSION_STRUCT.pack(SessionCipher.CIPHERS.index(cipher), len(nonce)) + nonce + encrypted_key.to_bytes(width, "big")
+
+    def unpack_session(self, data, offset, width):
+        '''
+        This method reads the session section of a hybrid ciphertext starting
+        at the offset and returns the session cipher, the nonce, the encrypted
+        session key and the offset of the payload.
+        '''
+
+        if len(data) < offset + self.__SESSION_STRUCT.size:
+            raise ValueError("Ciphertext is too short.")
+        cipher, nonce_length = self.__SESSION_STRUCT.unpack_from(data, offset)
+        if cipher >= len(SessionCipher.CIPHERS):
+            raise ValueError("Invalid ciphertext header.")
+        offset += self.__SESSION_STRUCT.size
+        if len(data) < offset + nonce_length + width:
+            raise ValueError("Ciphertext is too short.")
+        nonce = bytes(data[offset:offset + nonce_length])
+        offset += nonce_length
+        encrypted_key = int.from_bytes(data[offset:offset + width], "big")
+        return SessionCipher.CIPHERS[cipher], nonce, encrypted_key, offset + width
+
+    def read_session(self, reader, width):
+        '''
+        This method reads the session section of a hybrid ciphertext
+        from a file-like object, leaving it at the payload.
+        '''
+
+        data = reader.read(self.__SESSION_STRUCT.size)
+        if len(data) < self.__SESSION_STRUCT.size:
+            raise ValueError("Ciphertext is too short.")
+        data += reader.read(data[1] + width)
+        cipher, nonce, encrypted_key, offset = self.unpack_session(data, 0, width)
+        return cipher, nonce, encrypted_key
+
+    def armor(self, data):
+        encoded = base64.b64encode(data).decode("ascii")
+        lines = [encoded[i:i + self.ARMOR_LINE_LENGTH] for i in range(0, len(encoded), self.ARMOR_LINE_LENGTH)]
+        return "\n".join([self.ARMOR_BEGIN] + lines + [self.ARMOR_END])
+
+    def dearmor(self, text):
+        text = text.strip()
+        if not (text.startswith(self.ARMOR_BEGIN) and text.endswith(self.ARMOR_END)):
+            raise ValueError("Not an armored ciphertext.")
+        encoded = "".join(text[len(self.ARMOR_BEGIN):-len(self.ARMOR_END)].split())
+        return base64.b64decode(encoded, validate = True)
+
+    def is_armored(self, text):
+        return text.lstrip().startswith(self.ARMOR_BEGIN)
+
+    def is_binary(self, data):
+        return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(self.MAGIC)]) == self.MAGIC
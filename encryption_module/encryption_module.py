@@ -1,23 +1,77 @@
 import os
 import random
-import math
+import threading
 import numpy as np
 
 from .math_module import MathModule
+from .ciphertext_format import CiphertextFormat, CiphertextHeader
+from .key_format import KeyFormat
+from .worker_pool import WorkerPool
+from .key_pool import KeyPool
+from .session_cipher import SessionCipher
+from . import metrics
+
+class OperationCancelledError(Exception):
+    '''
+    Raised by a progress callback to cancel the running operation.
+    '''
+
+class _ProgressTracker:
+    '''
+    Reports the number of processed blocks to a progress callback
+    called as callback(done, total); total is None if it is unknown.
+    '''
+
+    def __init__(self, callback, total):
+        self.__callback = callback
+        self.__done = 0
+        self.__total = total
+
+    def advance(self, count):
+        self.__done += count
+        self.__callback(self.__done, self.__total)
 
 class EncryptionModule:
-    def __init__(self, mode = "ECB", generate_new_keys = True):
+    def __init__(self, mode = "ECB", generate_new_keys = True, workers = 1):
         self.__mm = MathModule()
+        self.__cf = CiphertextFormat()
+        self.__kf = KeyFormat()
+        self.__metrics = metrics.NullMetrics()
 
         self.__data_directory = "./data"
         self.__public_key_file = "public_key.txt"
         self.__private_key_file = "private_key.txt"
+        self.__public_key_binary_file = "public_key.bin"
+        self.__private_key_binary_file = "private_key.bin"
+        self.__key_format = "binary"   # format of the saved keys: "binary" (see KeyFormat) or "text" (hexadecimal lines)
         self.__block_size = 2   # in bytes
+        self.__encoding = "legacy"  # "legacy" (3 decimal digits per character) or "bytes" (UTF-8 bytes)
+        self.__output_format = "decimal"    # "decimal", "binary" or "armored"
+        self.__stream_chunk_blocks = 64  # number of blocks read at once by the stream methods
+        self.__progress_interval = 16   # number of blocks between the calls of a progress callback
+        self.__session_cipher = SessionCipher.get_default_cipher()   # payload cipher of the hybrid mode
+        self.__session_chunk_length = 1 << 20   # bytes of the payload encrypted at once in the hybrid mode
         self.__chosen_mode = mode
         self.__bits = 1024   # for 2048-bit key values
+        self.__parallel_prime_search = False    # whether p and q are searched for in separate processes
+        self.__key_pool_directory = "key_pool"
+        self.__exponent_policy = 65537  # fixed public exponent or "random" for a random one
+        self.__primes_count = 2     # number of primes of the modulus (more than 2 for multi-prime keys)
+        self.__key_pool = None
+
+        # Cache of the loaded keys: filename -> (modification time, size, key)
+        self.__key_cache = dict()
+        # Values derived from the loaded keys: n -> (modulus length, fingerprint)
+        self.__key_parameters = dict()
+
+        # Number of worker processes used for the exponentiation of ECB blocks
+        # (the pool is created on first use and reused afterwards)
+        self.__workers = workers
+        self.__pool = None
+        self.__pool_lock = threading.RLock()    # encrypt and decrypt may be called from several threads
 
         # Initializing an initialization vector, which is a self.__block_size byte long random number
-        self.__iv = random.randrange(2 ** (8 * self.__block_size - 1), 2 ** (8 * self.__block_size) - 1)    # used for CBC mode of operation
+        self.__iv = self.__generate_iv()    # used for CBC mode of operation
 
         # If generate_new_keys is False, but there are no private and
         # public key files generated then the program generates them anyway.
@@ -28,25 +82,253 @@ class EncryptionModule:
             if not os.path.isdir(self.__data_directory):
                 os.mkdir(self.__data_directory)
             
-            private_key_filename = self.__data_directory + "/" + self.__private_key_file
-            public_key_filename = self.__data_directory + "/" + self.__public_key_file
-            
-            if not (os.path.isfile(private_key_filename) and os.path.isfile(public_key_filename)):
+            if not (self.__has_key_files(self.__public_key_binary_file, self.__private_key_binary_file) or self.__has_key_files(self.__public_key_file, self.__private_key_file)):
                self.generate_pair_of_keys() 
 
+    def get_metrics(self):
+        return self.__metrics
+
     def get_mode(self):
         return self.__chosen_mode
 
     def get_block_size(self):
         return self.__block_size
 
+    def get_encoding(self):
+        return self.__encoding
+
+    def get_parallel_prime_search(self):
+        return self.__parallel_prime_search
+
+    def get_exponent_policy(self):
+        return self.__exponent_policy
+
+    def get_primes_count(self):
+        return self.__primes_count
+
+    def get_workers(self):
+        return self.__workers
+
+    def get_output_format(self):
+        return self.__output_format
+
+    def get_key_format(self):
+        return self.__key_format
+
+    def get_session_cipher(self):
+        return self.__session_cipher
+
+    def get_arithmetic_backend(self):
+        return self.__mm.get_backend()
+
+    def get_max_block_size(self):
+        '''
+        This method returns the largest block size for the chosen
+        encoding, for which every block value is smaller than
+        the modulus n of the loaded key.
+        '''
+
+        n, e = self.__load_public_key()
+        if self.__encoding == "bytes":
+            return (n.bit_length() - 1) // 8
+        block_size = 0
+        while 1000 ** (block_size + 1) < n:
+            block_size += 1
+        return block_size
+
+    def set_metrics(self, collector):
+        '''
+        This method sets the collector of the metrics (see the metrics module),
+        which records the time of every phase: key loading, block packing,
+        modular exponentiation, serialization, key generation and the session
+        cipher of the hybrid mode, as well as the number of processed blocks. None restores the default collector,
+        which records nothing.
+        '''
+
+        if collector is None:
+            collector = metrics.NullMetrics()
+        self.__metrics = collector
+
     def set_mode(self, mode):
-        if mode != "ECB" and mode != "CBC":
+        '''
+        This method sets the mode of operation: "ECB" or "CBC", where every
+        block of the message is encrypted with RSA, or "HYBRID", where RSA
+        encrypts only a random session key and the message is encrypted with
+        the session cipher (see set_session_cipher). Hybrid ciphertexts are
+        never written in the decimal format, the armored one is used instead.
+        A ValueError is raised for the hybrid mode if PyCryptodome is not installed.
+        '''
+
+        if mode != "ECB" and mode != "CBC" and mode != "HYBRID":
             return
+        if mode == "HYBRID":
+            SessionCipher.check_available(self.__session_cipher)
         self.__chosen_mode = mode
 
+    def set_session_cipher(self, cipher):
+        '''
+        This method chooses the payload cipher of the hybrid mode. The only
+        one is "aes-256-gcm" (needs PyCryptodome). A ValueError is raised
+        if the cipher is unknown or not available.
+        '''
+
+        SessionCipher.check_available(cipher)
+        self.__session_cipher = cipher
+
+    def set_encoding(self, encoding):
+        '''
+        This method sets the encoding of the message blocks. Choosing
+        the "bytes" encoding also sets the largest block size that fits
+        under the modulus of the loaded key.
+        '''
+
+        if encoding != "legacy" and encoding != "bytes":
+            return
+        self.__encoding = encoding
+        if encoding == "bytes":
+            self.set_block_size(self.get_max_block_size())
+        elif self.__block_size > self.get_max_block_size():
+            self.set_block_size(self.get_max_block_size())
+
+    def set_exponent_policy(self, policy):
+        '''
+        This method chooses the public exponent e of new keys: a fixed small
+        prime (65537 by default, which makes encryption much faster than
+        decryption) or "random" for the legacy random e in [2, phi).
+        A ValueError is raised for anything else. The policy applies
+        to keys generated afterwards (and to a key pool started afterwards).
+        '''
+
+        if policy != "random":
+            if not isinstance(policy, int) or policy < 3 or not self.__mm.is_probable_prime(policy):
+                raise ValueError("Public exponent has to be an odd prime or \"random\".")
+        self.__exponent_policy = policy
+
+    def set_primes_count(self, primes_count):
+        '''
+        This method sets the number of primes of new keys: 2 for the usual
+        RSA keys, 3 or 4 for multi-prime keys (RFC 8017) with the same modulus
+        size, whose smaller primes are faster to generate and make the CRT
+        decryption faster. A ValueError is raised for any other number or
+        for more primes than are recommended for the modulus size (at most
+        3 below 4096 bits, see MathModule.MAX_PRIMES_COUNTS).
+        The number applies to keys generated afterwards (and to a key pool
+        started afterwards).
+        '''
+
+        if not isinstance(primes_count, int) or primes_count < 2 or primes_count > 4:
+            raise ValueError("Number of primes has to be 2, 3 or 4.")
+        if primes_count > MathModule.get_max_primes_count(2 * self.__bits):
+            raise ValueError("Too many primes for a " + str(2 * self.__bits) + "-bit modulus.")
+        self.__primes_count = primes_count
+
+    def set_prime_search(self, prime_search):
+        '''
+        This method chooses how the primes of new keys are searched for:
+        "incremental" (sieved window after a random starting point) or "random".
+        '''
+
+        self.__mm.set_prime_search(prime_search)
+
+    def set_arithmetic_backend(self, backend):
+        '''
+        This method chooses the big integer arithmetic: "gmpy2" (GMP, the
+        default when gmpy2 is installed) or "python". A ValueError is raised
+        if the backend is unknown or not available.
+        '''
+
+        self.__mm.set_backend(backend)
+        self.__close_pool()
+
+    def set_parallel_prime_search(self, parallel):
+        '''
+        This method chooses whether the primes p and q of new keys
+        are searched for at the same time in two separate processes.
+        It applies to the pool of keys started afterwards as well.
+        '''
+
+        self.__parallel_prime_search = bool(parallel)
+
+    def set_workers(self, workers):
+        '''
+        This method sets the number of worker processes. With one
+        worker all of the blocks are processed in the calling process.
+        The workers are not forked (see WorkerPool), they import the main
+        module, so a script using more than one worker has to start its
+        work under if __name__ == "__main__".
+        '''
+
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("Number of workers has to be a positive integer.")
+        if workers == self.__workers:
+            return
+        self.__workers = workers
+        self.__close_pool()
+
+    def close(self):
+        '''
+        This method stops the worker processes and the pool of keys (if there are any).
+        '''
+
+        self.__close_pool()
+        self.stop_key_pool()
+
+    def set_output_format(self, output_format):
+        if output_format != "decimal" and output_format != "binary" and output_format != "armored":
+            return
+        self.__output_format = output_format
+
+    def set_key_format(self, key_format):
+        '''
+        This method sets the format in which new keys are saved: "binary"
+        (the default, loaded through a memory map without any parsing) or
+        "text" (hexadecimal values, one per line). The keys are loaded
+        from the binary files whenever they exist. A ValueError is raised
+        if the format is unknown.
+        '''
+
+        if key_format != "binary" and key_format != "text":
+            raise ValueError("Unknown key format: " + str(key_format))
+        self.__key_format = key_format
+
+    def convert_key_files(self):
+        '''
+        This method converts the key files in the text format to the
+        binary format, which is used from then on. The text files are
+        left in place.
+        '''
+
+        self.__kf.convert(
+            self.__data_directory + "/" + self.__public_key_file,
+            self.__data_directory + "/" + self.__private_key_file,
+            self.__data_directory + "/" + self.__public_key_binary_file,
+            self.__data_directory + "/" + self.__private_key_binary_file
+        )
+        self.clear_key_cache()
+
     def set_block_size(self, new_size):
+        '''
+        This method sets the block size. A ValueError is raised
+        if the size is not a positive integer or the block values
+        would not fit under the modulus of the loaded key.
+        '''
+
+        if not isinstance(new_size, int) or new_size < 1:
+            raise ValueError("Block size has to be a positive integer.")
+        max_block_size = self.get_max_block_size()
+        if new_size > max_block_size:
+            raise ValueError("Block size cannot exceed " + str(max_block_size) + " for the loaded key.")
         self.__block_size = new_size
+        self.__iv = self.__generate_iv()
+
+    def clear_key_cache(self):
+        '''
+        This method removes all of the keys kept in memory, so that
+        they are read again from the files on the next use.
+        '''
+
+        self.__key_cache.clear()
+        self.__key_parameters.clear()
 
     def generate_pair_of_keys(self):
         '''
@@ -56,229 +338,911 @@ class EncryptionModule:
         being a product of two chosen large primes, then the first line
         in the created files will be this value and the second line will
         be either e (public key case) or d (private key case) value.
+        In the binary key format the files are written by KeyFormat.
         '''
 
         print("[INFO] Generation a new pair of keys...")
 
-        # p, q = self.__m.choose_random_primes()
-        p = self.__mm.generate_large_prime(self.__bits)
-        q = self.__mm.generate_large_prime(self.__bits)
+        with self.__metrics.phase(metrics.KEY_GENERATION):
+            public_key, private_key = self.__mm.generate_rsa_key_pair(
+                self.__bits,
+                self.__primes_count if self.__parallel_prime_search else 1,
+                self.__get_public_exponent(),
+                self.__primes_count
+            )
+        self.__install_keys(public_key, private_key)
+
+        print("[INFO] Generation of new pair of keys finished.")
 
-        n = p * q
-        phi = (p - 1) * (q - 1)
+    def start_key_pool(self, size = 4, workers = 1):
+        '''
+        This method starts a pool of keys, which keeps size pairs of keys
+        generated in the background (by the given number of worker processes)
+        ready to be used by rotate_keys. The ready keys are also spooled to
+        the data directory, so they survive a restart.
+        '''
+
+        self.stop_key_pool()
+        self.__key_pool = KeyPool(
+            size,
+            self.__bits,
+            self.__data_directory + "/" + self.__key_pool_directory,
+            workers,
+            self.__mm.get_primality_test(),
+            self.__mm.get_prime_search(),
+            self.__get_public_exponent(),
+            self.__primes_count,
+            self.__primes_count if self.__parallel_prime_search else 1,
+            self.__mm.get_backend()
+        )
+
+    def stop_key_pool(self):
+        if self.__key_pool is not None:
+            self.__key_pool.stop()
+            self.__key_pool = None
+
+    def get_key_pool_stats(self):
+        '''
+        This method returns the fill level and the generation
+        rate of the pool of keys (None if it is not started).
+        '''
+
+        if self.__key_pool is None:
+            return None
+        return self.__key_pool.get_stats()
+
+    def rotate_keys(self):
+        '''
+        This method replaces the current pair of keys with a new one. If the
+        pool of keys is started the pair is taken from it (waiting only if the
+        pool is empty) and the pool refills in the background, otherwise
+        a new pair is generated in the calling thread.
+        '''
+
+        if self.__key_pool is None:
+            self.generate_pair_of_keys()
+            return
+        public_key, private_key = self.__key_pool.take()
+        self.__install_keys(public_key, private_key)
+        print("[INFO] Rotated to a pre-generated pair of keys.")
+
+    def __get_public_exponent(self):
+        if self.__exponent_policy == "random":
+            return None
+        return self.__exponent_policy
+
+    def __install_keys(self, public_key, private_key):
+        '''
+        This method saves a pair of keys to the key files
+        and makes them the keys used by this module.
+        '''
+
+        n, e = public_key
+        n, d, crt_params = private_key
 
-        e = self.__choose_encryption_value(phi)
-        d = self.__mm.calculate_multiplicative_inverse(e, phi)
-        
         # Save generated keys to corresponding files
         if not os.path.isdir(self.__data_directory):
             os.mkdir(self.__data_directory)
 
-        self.__save_public_key(n, e)
-        self.__save_private_key(n, d)
+        if self.__key_format == "binary":
+            self.__kf.write_key(self.__data_directory + "/" + self.__public_key_binary_file, self.__kf.pack_public_key(public_key))
+            self.__kf.write_key(self.__data_directory + "/" + self.__private_key_binary_file, self.__kf.pack_private_key(public_key, private_key))
+            self.__remove_key_files(self.__public_key_file, self.__private_key_file)
+        else:
+            self.__save_public_key(n, e)
+            self.__save_private_key(n, d, crt_params)
+            self.__remove_key_files(self.__public_key_binary_file, self.__private_key_binary_file)
+        self.clear_key_cache()
 
-        print("[INFO] Generation of new pair of keys finished.")
+        # The block size is chosen for the new modulus in the "bytes" encoding
+        if self.__encoding == "bytes":
+            self.set_block_size(self.get_max_block_size())
 
-    def encrypt(self, message):
+    def encrypt(self, message, progress = None):
         '''
         This method encrypts a given message in a specified 
         mode of operation (ECB or CBC) using the public key
         that was previously generated and saved to a file.
+        The ciphertext is returned in the chosen output format:
+        a string of decimal values ("decimal"), bytes ("binary")
+        or a base64 armored string ("armored").
+        The optional progress callback is called as progress(done, total)
+        with the numbers of encrypted and all blocks (chunks of the payload
+        in the hybrid mode); it can cancel the encryption by raising
+        OperationCancelledError.
         '''
 
-        print("Mode:", self.__chosen_mode, "\nBlock size:", self.__block_size)
-        if self.__chosen_mode == "ECB":
-            return self.__encrypt_ECB(message)
-        elif self.__chosen_mode == "CBC":
-            return self.__encrypt_CBC(message) 
+        if len(message) == 0:
+            return
 
-    def decrypt(self, ciphertext):
+        public_key = self.__load_public_key()
+        header = self.__create_header(public_key[0])
+        if header.mode == "HYBRID":
+            return self.__encrypt_hybrid(message.encode("utf-8"), header, public_key, progress)
+        blocks = self.__message_to_blocks(message, header)
+        tracker = _ProgressTracker(progress, len(blocks)) if progress is not None else None
+        if header.mode == "ECB":
+            blocks = self.__encrypt_ECB(blocks, public_key, tracker)
+        elif header.mode == "CBC":
+            blocks = self.__encrypt_CBC(blocks, header.iv, self.__get_chain_mask(header), public_key, tracker)
+        return self.__serialize(header, blocks)
+
+    def decrypt(self, ciphertext, progress = None):
         '''
-        This method decrypts a given ciphertext in a specified 
-        mode of operation (ECB or CBC) using the private key
-        that was previously generated and saved to a file.
+        This method decrypts a given ciphertext using the private key
+        that was previously generated and saved to a file. Binary and
+        armored ciphertexts carry their own mode of operation, encoding,
+        block size and IV. Ciphertexts in the legacy decimal format are
+        decrypted with the currently chosen settings.
+        The optional progress callback works as in encrypt.
+        '''
+
+        if len(ciphertext) == 0:
+            return
+
+        private_key = self.__load_private_key()
+        header, blocks = self.__deserialize(ciphertext, private_key[0])
+        if header.mode == "HYBRID":
+            return self.__decrypt_hybrid(blocks, header, private_key, progress)
+        tracker = _ProgressTracker(progress, len(blocks)) if progress is not None else None
+        if header.mode == "ECB":
+            blocks = self.__decrypt_ECB(blocks, private_key, tracker)
+        elif header.mode == "CBC":
+            blocks = self.__decrypt_CBC(blocks, header.iv, self.__get_chain_mask(header), private_key, tracker)
+        return self.__blocks_to_message(blocks, header)
+
+    def encrypt_many(self, messages):
+        '''
+        This method encrypts a list of messages at once and returns the list
+        of their ciphertexts (None for empty messages, as in encrypt). The key
+        and the settings are read once, and in ECB mode the blocks of all of
+        the messages are exponentiated as one list (using the pool of workers,
+        if there is one) and split back per message afterwards. In CBC mode
+        every message is a separate chain, so they are encrypted one by one,
+        as are the messages in the hybrid mode.
+        '''
+
+        public_key = self.__load_public_key()
+        header = self.__create_header(public_key[0])
+        if header.mode == "HYBRID":
+            return [self.encrypt(message) if len(message) > 0 else None for message in messages]
+        chain_mask = self.__get_chain_mask(header)
+
+        message_blocks = [self.__message_to_blocks(message, header) if len(message) > 0 else None for message in messages]
+        if header.mode == "ECB":
+            flat_blocks = [block for blocks in message_blocks if blocks is not None for block in blocks]
+            flat_blocks = self.__encrypt_ECB(flat_blocks, public_key)
+            message_blocks = self.__split_blocks(flat_blocks, message_blocks)
+        elif header.mode == "CBC":
+            for i in range(len(message_blocks)):
+                if message_blocks[i] is not None:
+                    message_blocks[i] = self.__encrypt_CBC(message_blocks[i], header.iv, chain_mask, public_key)
+
+        return [self.__serialize(header, blocks) if blocks is not None else None for blocks in message_blocks]
+
+    def decrypt_many(self, ciphertexts):
+        '''
+        This method decrypts a list of ciphertexts at once and returns the list
+        of the decrypted messages (None for empty ciphertexts and for the None
+        entries returned by encrypt_many for empty messages). The blocks of
+        all of the ciphertexts are exponentiated as one list, regardless of the
+        mode, and split back per ciphertext. The XOR chain of the CBC
+        ciphertexts is applied afterwards. Hybrid ciphertexts are
+        decrypted one by one.
+        '''
+
+        private_key = self.__load_private_key()
+        headers = list()
+        ciphertext_blocks = list()
+        hybrid_payloads = dict()
+        for ciphertext in ciphertexts:
+            if ciphertext is None or len(ciphertext) == 0:
+                headers.append(None)
+                ciphertext_blocks.append(None)
+                continue
+            header, blocks = self.__deserialize(ciphertext, private_key[0])
+            headers.append(header)
+            if header.mode == "HYBRID":
+                hybrid_payloads[len(headers) - 1] = blocks
+                blocks = None
+            ciphertext_blocks.append(blocks)
+
+        flat_blocks = [block for blocks in ciphertext_blocks if blocks is not None for block in blocks]
+        flat_blocks = self.__decrypt_ECB(flat_blocks, private_key)
+        decrypted_blocks = self.__split_blocks(flat_blocks, ciphertext_blocks)
+
+        messages = list()
+        for i, (header, blocks, decrypted) in enumerate(zip(headers, ciphertext_blocks, decrypted_blocks)):
+            if header is None:
+                messages.append(None)
+                continue
+            if header.mode == "HYBRID":
+                messages.append(self.__decrypt_hybrid(hybrid_payloads[i], header, private_key))
+                continue
+            if header.mode == "CBC":
+                decrypted = self.__apply_CBC_chain(decrypted, blocks, header.iv, self.__get_chain_mask(header))
+            messages.append(self.__blocks_to_message(decrypted, header))
+        return messages
+
+    def encrypt_stream(self, reader, writer, progress = None, total_blocks = None):
+        '''
+        This method encrypts everything that can be read from the reader
+        (a file-like object in binary or text mode) and writes the binary
+        ciphertext to the writer (a file-like object in binary mode).
+        The input is processed in chunks of a fixed number of blocks, so the
+        memory used does not depend on its size. Streams always use the
+        "bytes" encoding; in CBC mode the chaining value is carried from
+        one chunk to the next. Returns the number of encrypted blocks
+        (of encrypted bytes in the hybrid mode). The optional progress
+        callback works as in encrypt, with the total being total_blocks
+        (None if it is not given).
+        '''
+
+        public_key = self.__load_public_key()
+        header = self.__create_stream_header(public_key[0])
+        if header.mode == "HYBRID":
+            return self.__encrypt_hybrid_stream(reader, writer, header, public_key, progress, total_blocks)
+        block_size = header.block_size
+        width = header.modulus_length
+        chain_mask = self.__get_chain_mask(header)
+        xor_value = header.iv
+        chunk_size = block_size * self.__stream_chunk_blocks
+        blocks_count = 0
+        tracker = _ProgressTracker(progress, total_blocks) if progress is not None else None
+
+        writer.write(self.__cf.pack_header(header))
+
+        buffer = b""
+        finished = False
+        while not finished:
+            chunk = reader.read(chunk_size)
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            buffer += chunk
+            if len(chunk) == 0:
+                buffer = self.__pad(buffer, block_size)
+                finished = True
+
+            # Only the whole blocks are encrypted, the rest waits for the next chunk
+            usable = len(buffer) - len(buffer) % block_size
+            if usable == 0:
+                continue
+            blocks = self.__bytes_to_blocks(buffer[:usable], block_size)
+            buffer = buffer[usable:]
+
+            if header.mode == "ECB":
+                blocks = self.__encrypt_ECB(blocks, public_key, tracker)
+            elif header.mode == "CBC":
+                blocks = self.__encrypt_CBC(blocks, xor_value, chain_mask, public_key, tracker)
+                xor_value = blocks[-1] & chain_mask
+
+            writer.write(b"".join(block.to_bytes(width, "big") for block in blocks))
+            blocks_count += len(blocks)
+
+        return blocks_count
+
+    def decrypt_stream(self, reader, writer, progress = None, total_blocks = None):
+        '''
+        This method decrypts a binary ciphertext read from the reader
+        (a file-like object in binary mode) and writes the decrypted UTF-8
+        bytes to the writer (a file-like object in binary mode). The blocks
+        are processed in chunks and only the last decrypted block is held
+        back until the end of the input, because it contains the padding.
+        Returns the number of decrypted blocks (of decrypted bytes in the
+        hybrid mode). The optional progress callback works as in encrypt_stream.
+        In the hybrid mode the data is written before the authentication tag
+        at the end of the input is verified, so if a ValueError is raised,
+        everything written has to be discarded.
+        '''
+
+        private_key = self.__load_private_key()
+        header = self.__cf.read_header(reader)
+        if header.fingerprint != self.__get_key_parameters(private_key[0])[1]:
+            raise ValueError("Ciphertext was encrypted with a different key.")
+        if header.mode == "HYBRID":
+            return self.__decrypt_hybrid_stream(reader, writer, header, private_key, progress, total_blocks)
+        if header.encoding != "bytes":
+            raise ValueError("Only ciphertexts in the \"bytes\" encoding can be decrypted as a stream.")
+
+        block_size = header.block_size
+        width = header.modulus_length
+        chain_mask = self.__get_chain_mask(header)
+        xor_value = header.iv
+        chunk_size = width * self.__stream_chunk_blocks
+        blocks_count = 0
+        tracker = _ProgressTracker(progress, total_blocks) if progress is not None else None
+
+        last_block = None
+        while True:
+            data = self.__read_exactly(reader, chunk_size)
+            if len(data) % width != 0:
+                raise ValueError("Ciphertext is truncated.")
+            if len(data) == 0:
+                break
+            blocks = [int.from_bytes(data[i:i + width], "big") for i in range(0, len(data), width)]
+            blocks_count += len(blocks)
+
+            if header.mode == "ECB":
+                blocks = self.__decrypt_ECB(blocks, private_key, tracker)
+            elif header.mode == "CBC":
+                next_xor_value = blocks[-1] & chain_mask
+                blocks = self.__decrypt_CBC(blocks, xor_value, chain_mask, private_key, tracker)
+                xor_value = next_xor_value
+
+            if last_block is not None:
+                writer.write(last_block)
+            data = b"".join(block.to_bytes(block_size, "big") for block in blocks)
+            writer.write(data[:-block_size])
+            last_block = data[-block_size:]
+
+        if last_block is None:
+            raise ValueError("Ciphertext does not contain any blocks.")
+        writer.write(self.__unpad(last_block))
+
+        return blocks_count
+
+    def __encrypt_hybrid(self, data, header, public_key, progress = None):
+        '''
+        This method encrypts the data in the hybrid mode and returns the
+        ciphertext: the header, the session section and the payload
+        encrypted with the session cipher followed by its tag.
+        '''
+
+        prefix, cipher = self.__start_hybrid_encryption(header, public_key)
+        chunk_length = self.__session_chunk_length
+        tracker = _ProgressTracker(progress, -(-len(data) // chunk_length)) if progress is not None else None
+
+        parts = [prefix]
+        with self.__metrics.phase(metrics.SESSION_CIPHER):
+            self.__metrics.count("bytes_encrypted", len(data))
+            for start in range(0, len(data), chunk_length):
+                parts.append(cipher.encrypt(data[start:start + chunk_length]))
+                if tracker is not None:
+                    tracker.advance(1)
+            parts.append(cipher.get_tag())
+        return self.__serialize_data(b"".join(parts))
+
+    def __decrypt_hybrid(self, data, header, private_key, progress = None):
+        '''
+        This method decrypts the part of a hybrid ciphertext following the
+        header. A ValueError is raised if the authentication fails.
+        '''
+
+        cipher_name, nonce, encrypted_key, offset = self.__cf.unpack_session(data, 0, header.modulus_length)
+        if len(data) < offset + SessionCipher.TAG_LENGTH:
+            raise ValueError("Ciphertext is truncated.")
+        cipher = self.__start_hybrid_decryption(header, cipher_name, nonce, encrypted_key, private_key)
+        payload = memoryview(data)[offset:len(data) - SessionCipher.TAG_LENGTH]
+        chunk_length = self.__session_chunk_length
+        tracker = _ProgressTracker(progress, -(-len(payload) // chunk_length)) if progress is not None else None
+
+        parts = list()
+        with self.__metrics.phase(metrics.SESSION_CIPHER):
+            self.__metrics.count("bytes_decrypted", len(payload))
+            for start in range(0, len(payload), chunk_length):
+                parts.append(cipher.decrypt(payload[start:start + chunk_length]))
+                if tracker is not None:
+                    tracker.advance(1)
+            cipher.verify(data[len(data) - SessionCipher.TAG_LENGTH:])
+        return b"".join(parts).decode("utf-8")
+
+    def __encrypt_hybrid_stream(self, reader, writer, header, public_key, progress, total_chunks):
+        prefix, cipher = self.__start_hybrid_encryption(header, public_key)
+        tracker = _ProgressTracker(progress, total_chunks) if progress is not None else None
+        writer.write(prefix)
+
+        bytes_count = 0
+        while True:
+            chunk = reader.read(self.__session_chunk_length)
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if len(chunk) == 0:
+                break
+            with self.__metrics.phase(metrics.SESSION_CIPHER):
+                self.__metrics.count("bytes_encrypted", len(chunk))
+                writer.write(cipher.encrypt(chunk))
+            bytes_count += len(chunk)
+            if tracker is not None:
+                tracker.advance(1)
+
+        writer.write(cipher.get_tag())
+        return bytes_count
+
+    def __decrypt_hybrid_stream(self, reader, writer, header, private_key, progress, total_chunks):
         '''
-        if self.__chosen_mode == "ECB":
-            return self.__decrypt_ECB(ciphertext)
-        elif self.__chosen_mode == "CBC":
-            return self.__decrypt_CBC(ciphertext)
+        This method decrypts the rest of a hybrid ciphertext read from the
+        reader. The last bytes read are always held back, since the input
+        ends with the authentication tag.
+        '''
+
+        cipher_name, nonce, encrypted_key = self.__cf.read_session(reader, header.modulus_length)
+        cipher = self.__start_hybrid_decryption(header, cipher_name, nonce, encrypted_key, private_key)
+        tracker = _ProgressTracker(progress, total_chunks) if progress is not None else None
+
+        bytes_count = 0
+        buffer = b""
+        while True:
+            chunk = self.__read_exactly(reader, self.__session_chunk_length)
+            if len(chunk) == 0:
+                break
+            buffer += chunk
+            usable = len(buffer) - SessionCipher.TAG_LENGTH
+            if usable <= 0:
+                continue
+            with self.__metrics.phase(metrics.SESSION_CIPHER):
+                self.__metrics.count("bytes_decrypted", usable)
+                writer.write(cipher.decrypt(buffer[:usable]))
+            buffer = buffer[usable:]
+            bytes_count += usable
+            if tracker is not None:
+                tracker.advance(1)
+
+        if len(buffer) < SessionCipher.TAG_LENGTH:
+            raise ValueError("Ciphertext is truncated.")
+        cipher.verify(buffer)
+        return bytes_count
+
+    def __start_hybrid_encryption(self, header, public_key):
+        '''
+        This method generates a random session key and returns the beginning
+        of a hybrid ciphertext (the header and the session section, with the
+        session key encrypted with RSA) and the session cipher, which
+        authenticates that beginning as its associated data.
+        '''
+
+        session_key = os.urandom(SessionCipher.KEY_LENGTH)
+        nonce = os.urandom(SessionCipher.get_nonce_length(self.__session_cipher))
+
+        # The session key is placed at the end of a block filled with random bytes
+        key_block = int.from_bytes(os.urandom(header.block_size - SessionCipher.KEY_LENGTH) + session_key, "big")
+        encrypted_key = self.__encrypt_ECB([key_block], public_key)[0]
+
+        prefix = self.__cf.pack_header(header) + self.__cf.pack_session(self.__session_cipher, nonce, encrypted_key, header.modulus_length)
+        return prefix, SessionCipher(self.__session_cipher, session_key, nonce, prefix)
+
+    def __start_hybrid_decryption(self, header, cipher_name, nonce, encrypted_key, private_key):
+        SessionCipher.check_available(cipher_name)
+        key_block = self.__decrypt_ECB([encrypted_key], private_key)[0]
+        if key_block.bit_length() > 8 * header.block_size:
+            raise ValueError("Invalid session key.")
+        session_key = key_block.to_bytes(header.block_size, "big")[-SessionCipher.KEY_LENGTH:]
+
+        prefix = self.__cf.pack_header(header) + self.__cf.pack_session(cipher_name, nonce, encrypted_key, header.modulus_length)
+        return SessionCipher(cipher_name, session_key, nonce, prefix)
 
-    def __encrypt_ECB(self, message):
+    def __encrypt_ECB(self, blocks, public_key, tracker = None):
         '''
         Description:
-        1) We create an empty list of message blocks (blocks of size equal to self.__block_size bytes),
-        2) We create and initialize a message_block_value with the ASCII value of the message's first character,
-        3) Then we iterate over the rest of message's characters and add their ASCII values to the subsequent blocks,
-        4) One block contains a number which is in a form of 4 concatenated ASCII decimal values of the characters,
-        5) This number (one block) is then taken to power of e and applied modulo n on,
-        6) The obtained value will be the one ciphertext block value of of one message block,
+        1) We get a list of message block values (see __message_to_blocks),
+        2) Each number (one block) is then taken to power of e and applied modulo n on,
+        3) The obtained value will be the one ciphertext block value of of one message block.
         '''
 
-        if len(message) == 0:
-            return
+        with self.__metrics.phase(metrics.MODEXP):
+            self.__metrics.count("blocks_encrypted", len(blocks))
+            n, e = public_key
 
-        n, e = self.__load_public_key()
-        blocks = list()
-        block_value = ord(message[0])
-        for i in range(1, len(message)):            
-            # If the mas block size is reached add the ciphertext to the list and reset it
-            if i % self.__block_size == 0:
-                blocks.append(block_value)
-                block_value = 0
+            pool = self.__get_pool(len(blocks))
+            if pool is not None:
+                return pool.encrypt(blocks, tracker.advance if tracker is not None else None)
 
-            # Multiply by 1000 to shift the number by 3 digits to the left
-            block_value = block_value * 1000 + ord(message[i])
+            # Encrypt all of the numbers
+            for i in range(len(blocks)):
+                blocks[i] = self.__mm.powmod(blocks[i], e, n)
+                self.__report_progress(tracker, i, len(blocks))
 
-        # Adding the last block
-        blocks.append(block_value)
+            return blocks
 
-        # Encrypt all of the numbers
-        for i in range(len(blocks)):
-            block = str(pow(blocks[i], e, n))
-            blocks[i] = block
+    def __decrypt_ECB(self, blocks, private_key, tracker = None):
+        '''
+        Description:
+        1) We get a list of integer ciphertext block values (see __deserialize),
+        2) We iterate over that list and decrypt the blocks one by one by applying the power to d and modulo n,
+        3) Then we receive a list of decrypted blocks of integer values,
+           which are transformed into a string of characters (see __blocks_to_message).
+        '''
+
+        with self.__metrics.phase(metrics.MODEXP):
+            self.__metrics.count("blocks_decrypted", len(blocks))
+            pool = self.__get_pool(len(blocks))
+            if pool is not None:
+                return pool.decrypt(blocks, tracker.advance if tracker is not None else None)
 
-        ciphertext = " ".join(blocks)
+            for i in range(len(blocks)):
+                blocks[i] = self.__decrypt_value(blocks[i], private_key)
+                self.__report_progress(tracker, i, len(blocks))
 
-        return ciphertext
+            return blocks
 
-    def __decrypt_ECB(self, ciphertext):
+    def __encrypt_CBC(self, blocks, iv, chain_mask, public_key, tracker = None):
         '''
         Description:
-        1) The ciphertext is a string made of blocks of integer values separated by spaces.
-        2) We split this ciphertext string into a list of string blocks, which represent some integer value,
-        3) We convert those string blocks into integer blocks and obtain a list of integer values,
-        4) We iterate over that list and decrypt the blocks one by one by applying the power to d and modulo n,
-        5) Then we receive a list of decrypted blocks of integer values,
-        6) We transform the list of decrypted integer values block by block into a string of characters.
+        1) We get a list of message block values (see __message_to_blocks),
+        2) Each number (one block) is then XOR'ed with the previous block's encrypted value and then taken to the power e and applied modulo n
+           (in case of the first block we use the initialization vector for the XOR operation),
+        3) The obtained value will be the one ciphertext block value of of one message block.
         '''
 
-        if len(ciphertext) == 0:
+        with self.__metrics.phase(metrics.MODEXP):
+            self.__metrics.count("blocks_encrypted", len(blocks))
+            n, e = public_key
+
+            # Encrypt all of the numbers
+            xor_value = iv
+            for i in range(len(blocks)):
+                blocks[i] ^= xor_value
+                encrypted_value = self.__mm.powmod(blocks[i], e, n)
+                xor_value = encrypted_value & chain_mask
+                blocks[i] = encrypted_value
+                self.__report_progress(tracker, i, len(blocks))
+
+            return blocks
+
+    def __decrypt_CBC(self, blocks, iv, chain_mask, private_key, tracker = None):
+        '''
+        Description:
+        1) We get a list of integer ciphertext block values (see __deserialize),
+        2) We iterate over that list and decrypt the blocks one by one by applying the power d and then modulo n,
+            2.1) After each block's decryption we apply a XOR operation with the previous block's encrypted value
+                 (in case of the first block we use the initialization vector for the XOR operation),
+        3) Then we receive a list of decrypted blocks of integer values,
+           which are transformed into a string of characters (see __blocks_to_message).
+        Since every plaintext block depends only on the current and the previous
+        ciphertext block, with the pool of workers all of the blocks are first
+        decrypted in parallel and the XOR chain is applied afterwards.
+        '''
+
+        with self.__metrics.phase(metrics.MODEXP):
+            self.__metrics.count("blocks_decrypted", len(blocks))
+            pool = self.__get_pool(len(blocks))
+            if pool is not None:
+                decrypted_values = pool.decrypt(blocks, tracker.advance if tracker is not None else None)
+                return self.__apply_CBC_chain(decrypted_values, blocks, iv, chain_mask)
+
+            xor_value = iv
+            for i in range(len(blocks)):
+                decrypted_value = self.__decrypt_value(blocks[i], private_key) ^ xor_value
+                xor_value = blocks[i] & chain_mask
+                blocks[i] = decrypted_value
+                self.__report_progress(tracker, i, len(blocks))
+
+            return blocks
+
+    def __report_progress(self, tracker, index, count):
+        '''
+        This method reports the progress after every __progress_interval
+        blocks and after the last block of the list.
+        '''
+
+        if tracker is None:
             return
+        done = index + 1
+        if done % self.__progress_interval == 0:
+            tracker.advance(self.__progress_interval)
+        elif done == count:
+            tracker.advance(done % self.__progress_interval)
 
-        n, d = self.__load_private_key()
-        blocks = ciphertext.split()
+    def __apply_CBC_chain(self, decrypted_values, blocks, iv, chain_mask):
+        '''
+        This method XORs the already exponentiated CBC blocks with the
+        previous ciphertext blocks (the first one with the IV).
+        '''
 
+        xor_value = iv
         for i in range(len(blocks)):
-            blocks[i] = int(blocks[i])
+            decrypted_values[i] ^= xor_value
+            xor_value = blocks[i] & chain_mask
+        return decrypted_values
 
-        decrypted_message = ""
+    def __create_header(self, n):
+        '''
+        This method returns the header describing a ciphertext
+        encrypted with the current settings and the key of modulus n.
+        In the hybrid mode the block size is the size of the block carrying
+        the session key (the largest one of the "bytes" encoding).
+        '''
 
-        for i in range(len(blocks)):
-            decrypted_block = pow(blocks[i], d, n)
-            blocks[i] = decrypted_block
+        modulus_length, fingerprint = self.__get_key_parameters(n)
+        if self.__chosen_mode == "HYBRID":
+            block_size = (n.bit_length() - 1) // 8
+            if block_size <= SessionCipher.KEY_LENGTH:
+                raise ValueError("Modulus of the key is too small for the hybrid mode.")
+            return CiphertextHeader("HYBRID", "bytes", block_size, 0, modulus_length, fingerprint)
+
+        return CiphertextHeader(
+            self.__chosen_mode,
+            self.__encoding,
+            self.__block_size,
+            self.__iv,
+            modulus_length,
+            fingerprint
+        )
+
+    def __get_key_parameters(self, n):
+        '''
+        This method returns the modulus length and the fingerprint of the
+        key of modulus n. They are read from the binary key files or
+        calculated once per key and then kept with the cached keys.
+        '''
+
+        parameters = self.__key_parameters.get(n)
+        if parameters is None:
+            parameters = ((n.bit_length() + 7) // 8, CiphertextFormat.calculate_fingerprint(n))
+            self.__key_parameters[n] = parameters
+        return parameters
 
-            tmp = ""
+    def __create_stream_header(self, n):
+        '''
+        This method returns the header of a ciphertext written by
+        encrypt_stream. If the "legacy" encoding is chosen, then the
+        largest block size of the "bytes" encoding is used instead.
+        '''
 
-            for c in range(self.__block_size):
-                if not blocks[i] == 0:
-                    tmp = chr(blocks[i] % 1000) + tmp
-                blocks[i] //= 1000
+        header = self.__create_header(n)
+        if header.encoding != "bytes" and header.mode != "HYBRID":
+            header.encoding = "bytes"
+            header.block_size = (n.bit_length() - 1) // 8
+            header.iv = random.randrange(2 ** (8 * header.block_size - 1), 2 ** (8 * header.block_size) - 1)
+        return header
 
-            decrypted_message += tmp
+    def __serialize(self, header, blocks):
+        '''
+        This method writes the ciphertext blocks in the chosen output format.
+        '''
 
-        return decrypted_message
+        with self.__metrics.phase(metrics.SERIALIZATION):
+            if self.__output_format == "decimal":
+                return " ".join(str(block) for block in blocks)
+            data = self.__cf.pack(header, blocks)
+            if self.__output_format == "armored":
+                return self.__cf.armor(data)
+            return data
 
-    def __encrypt_CBC(self, message):
+    def __serialize_data(self, data):
         '''
-        Description:
-        1) We create an empty list of message blocks (blocks of size equal to self.__block_size bytes),
+        This method writes a binary hybrid ciphertext in the chosen output
+        format. The decimal format cannot carry it, so it is armored instead.
+        '''
+
+        with self.__metrics.phase(metrics.SERIALIZATION):
+            if self.__output_format == "binary":
+                return data
+            return self.__cf.armor(data)
+
+    def __deserialize(self, ciphertext, n):
+        '''
+        This method detects the format of a ciphertext and returns its
+        header and the list of integer blocks (for a hybrid ciphertext,
+        the data following the header). A ValueError is raised if the
+        ciphertext was encrypted with a different key.
+        '''
+
+        with self.__metrics.phase(metrics.SERIALIZATION):
+            if isinstance(ciphertext, str) and self.__cf.is_armored(ciphertext):
+                ciphertext = self.__cf.dearmor(ciphertext)
+
+            if isinstance(ciphertext, str):
+                # Legacy format: the blocks are decimal integers separated by spaces
+                header = self.__create_header(n)
+                if header.mode == "HYBRID":
+                    raise ValueError("Ciphertexts in the decimal format cannot be decrypted in the hybrid mode.")
+                blocks = [int(block) for block in ciphertext.split()]
+                return header, blocks
+
+            header, offset = self.__cf.unpack_header(ciphertext)
+            if header.fingerprint != self.__get_key_parameters(n)[1]:
+                raise ValueError("Ciphertext was encrypted with a different key.")
+            if header.mode == "HYBRID":
+                return header, ciphertext[offset:]
+            header, blocks = self.__cf.unpack(ciphertext)
+            return header, blocks
+
+    def __message_to_blocks(self, message, header):
+        '''
+        This method splits a message into a list of integer block values
+        using the chosen encoding.
+        In the "legacy" encoding:
+        1) We create an empty list of message blocks (blocks of size equal to the block size characters),
         2) We create and initialize a message_block_value with the ASCII value of the message's first character,
         3) Then we iterate over the rest of message's characters and add their ASCII values to the subsequent blocks,
-        4) One block contains a number which is in a form of 4 concatenated ASCII decimal values of the characters,
-        5) This number (one block) is then XOR'ed with the previous block's encrypted value and then taken to the power e and applied modulo n
-           (in case of the first block we use the initialization vector for the XOR operation),
-        6) The obtained value will be the one ciphertext block value of of one message block,
+        4) One block contains a number which is in a form of concatenated 3-digit ASCII decimal values of the characters.
+        The 3-digit values are built for the whole message at once with numpy and
+        every block is parsed from its decimal digits; the character by character
+        loop is kept for messages with characters of code 1000 or more, which
+        spill over into the digits of the previous character.
+        In the "bytes" encoding the message is encoded in UTF-8, padded (a 0x80 byte
+        followed by zero bytes) to a multiple of the block size bytes and every
+        block size bytes are read as one big-endian integer.
         '''
 
-        if len(message) == 0:
-            return
+        with self.__metrics.phase(metrics.BLOCK_PACKING):
+            block_size = header.block_size
+            if header.encoding == "bytes":
+                data = self.__pad(message.encode("utf-8"), block_size)
+                return self.__bytes_to_blocks(data, block_size)
 
-        n, e = self.__load_public_key()
-        blocks = list()
-        block_value = ord(message[0])
-        for i in range(1, len(message)):            
-            # If the mas block size is reached add the ciphertext to the list and reset it
-            if i % self.__block_size == 0:
-                blocks.append(block_value)
-                block_value = 0
-
-            # Multiply by 1000 to shift the number by 3 digits to the left
-            block_value = block_value * 1000 + ord(message[i])
-
-        # Adding the last block
-        blocks.append(block_value)
-
-        # Encrypt all of the numbers
-        xor_value = self.__iv
-        for i in range(len(blocks)):
-            blocks[i] ^= xor_value
-            encrypted_value = pow(blocks[i], e, n)
-            xor_value = encrypted_value
-            block = str(encrypted_value)
-            blocks[i] = block
+            codes = np.frombuffer(message.encode("utf-32-le", "surrogatepass"), dtype = np.uint32)
+            if codes.max() < 1000:
+                return self.__legacy_codes_to_blocks(codes, block_size)
 
-        ciphertext = " ".join(blocks)
+            blocks = list()
+            block_value = ord(message[0])
+            for i in range(1, len(message)):            
+                # If the mas block size is reached add the ciphertext to the list and reset it
+                if i % block_size == 0:
+                    blocks.append(block_value)
+                    block_value = 0
 
-        return ciphertext
+                # Multiply by 1000 to shift the number by 3 digits to the left
+                block_value = block_value * 1000 + ord(message[i])
 
+            # Adding the last block
+            blocks.append(block_value)
 
-    def __decrypt_CBC(self, ciphertext):
+            return blocks
+
+    def __blocks_to_message(self, blocks, header):
         '''
-        Description:
-        1) The ciphertext is a string made of blocks of integer values separated by spaces.
-        2) We split this ciphertext string into a list of string blocks, which represent some integer value,
-        3) We convert those string blocks into integer blocks and obtain a list of integer values,
-        4) We iterate over that list and decrypt the blocks one by one by applying the power d and then modulo n,
-            4.1) After each block's decryption we apply a XOR operation with the previous block's encrypted value
-                 (in case of the first block we use the initialization vector for the XOR operation),
-        5) Then we receive a list of decrypted blocks of integer values,
-        6) We transform the list of decrypted integer values block by block into a string of characters.
+        This method transforms a list of decrypted integer block
+        values back into a string of characters (it reverses
+        the __message_to_blocks method).
         '''
 
-        if len(ciphertext) == 0:
-            return
+        with self.__metrics.phase(metrics.BLOCK_PACKING):
+            block_size = header.block_size
+            if header.encoding == "bytes":
+                data = b"".join(block.to_bytes(block_size, "big") for block in blocks)
+                return self.__unpad(data).decode("utf-8")
 
-        n, d = self.__load_private_key()
-        blocks = ciphertext.split()
+            return self.__legacy_blocks_to_string(blocks, block_size)
 
-        for i in range(len(blocks)):
-            blocks[i] = int(blocks[i])
+    def __legacy_codes_to_blocks(self, codes, block_size):
+        '''
+        This method writes every character code as 3 decimal digits and reads
+        every block size characters (3 * block size digits) as one block value.
+        '''
 
-        decrypted_message = ""
+        digits = np.empty((len(codes), 3), dtype = np.uint8)
+        digits[:, 0] = codes // 100
+        digits[:, 1] = codes // 10 % 10
+        digits[:, 2] = codes % 10
+        digits += ord("0")
+        text = digits.tobytes()
 
+        width = 3 * block_size
+        return [int(text[i:i + width]) for i in range(0, len(text), width)]
 
-        xor_value = self.__iv
-        for i in range(len(blocks)):
-            decrypted_value = pow(blocks[i], d, n) ^ xor_value
-            xor_value = blocks[i]
-            blocks[i] = decrypted_value
+    def __legacy_blocks_to_string(self, blocks, block_size):
+        '''
+        This method reverses __legacy_codes_to_blocks. Every block value gives
+        its lowest block size 3-digit groups (fewer if the value is shorter, none
+        if it is zero), which are converted to characters all at once.
+        '''
 
-            tmp = ""
+        width = 3 * block_size
+        groups = list()
+        for block in blocks:
+            if block == 0:
+                continue
+            digits = str(block)
+            if len(digits) > width:
+                digits = digits[-width:]
+            groups.append(digits.zfill(len(digits) + (-len(digits)) % 3))
+
+        if len(groups) == 0:
+            return ""
+        digits = np.frombuffer("".join(groups).encode("ascii"), dtype = np.uint8).reshape(-1, 3).astype(np.uint32) - ord("0")
+        codes = digits[:, 0] * 100 + digits[:, 1] * 10 + digits[:, 2]
+        return codes.astype("<u4").tobytes().decode("utf-32-le")
+
+    def __split_blocks(self, flat_blocks, lists_of_blocks):
+        '''
+        This method splits a flat list of blocks back into lists of the same
+        lengths as the given ones (None entries are kept as they are).
+        '''
 
-            for j in range(self.__block_size):
-                if not blocks[i] == 0:
-                    tmp = chr(blocks[i] % 1000) + tmp
-                blocks[i] //= 1000
-            decrypted_message += tmp
+        result = list()
+        offset = 0
+        for blocks in lists_of_blocks:
+            if blocks is None:
+                result.append(None)
+                continue
+            result.append(flat_blocks[offset:offset + len(blocks)])
+            offset += len(blocks)
+        return result
 
-        return decrypted_message
+    def __bytes_to_blocks(self, data, block_size):
+        return [int.from_bytes(data[i:i + block_size], "big") for i in range(0, len(data), block_size)]
 
-    def __choose_encryption_value(self, phi):
+    def __pad(self, data, block_size):
         '''
-        This method chooses an encryption value between
-        1 and phi exclusive, which is relatively prime with phi.
+        This method pads the data with a 0x80 byte followed by
+        zero bytes up to a multiple of the block size.
         '''
 
-        while True:
-            e = random.randrange(2, phi)
-            if (math.gcd(e, phi) == 1):
+        data += b"\x80"
+        return data + bytes(-len(data) % block_size)
+
+    def __unpad(self, data):
+        data = data.rstrip(b"\x00")
+        if not data.endswith(b"\x80"):
+            raise ValueError("Invalid padding of the decrypted message.")
+        return data[:-1]
+
+    def __read_exactly(self, reader, size):
+        '''
+        This method reads from the reader until size bytes
+        are collected or the end of the input is reached.
+        '''
+
+        data = reader.read(size)
+        while 0 < len(data) < size:
+            chunk = reader.read(size - len(data))
+            if len(chunk) == 0:
                 break
-        return e
+            data += chunk
+        return data
+
+    def __get_chain_mask(self, header):
+        '''
+        This method returns the mask applied to the previous ciphertext
+        block before it is XOR'ed with the next block in CBC mode.
+        In the "bytes" encoding the chained value is cut down to the
+        block size, so that the XOR'ed block is still smaller than n.
+        The "legacy" encoding chains the full ciphertext value.
+        '''
 
-    def __save_private_key(self, n, d):
+        if header.encoding == "bytes":
+            return (1 << (8 * header.block_size)) - 1
+        return -1
+
+    def __decrypt_value(self, value, private_key):
+        '''
+        This method decrypts a single block value. If the private key
+        carries the CRT parameters, then two half-size exponentiations
+        (modulo p and modulo q) are used instead of one full-size
+        exponentiation modulo n. Keys saved without those parameters
+        fall back to the plain pow(value, d, n).
+        '''
+
+        return MathModule.private_pow(value, private_key, self.__mm.get_backend())
+
+    def __get_pool(self, blocks_count):
+        '''
+        This method returns the pool of worker processes or None, when
+        the blocks should be processed in the calling process (single
+        worker or a single block). The pool is created again only
+        if the keys have changed since it was started.
+        '''
+
+        if self.__workers < 2 or blocks_count < 2:
+            return None
+
+        public_key = self.__load_public_key()
+        private_key = self.__load_private_key()
+        with self.__pool_lock:
+            if self.__pool is not None and not self.__pool.has_keys(public_key, private_key):
+                self.__close_pool()
+            if self.__pool is None:
+                self.__pool = WorkerPool(self.__workers, public_key, private_key, self.__mm.get_backend())
+            return self.__pool
+
+    def __close_pool(self):
+        with self.__pool_lock:
+            if self.__pool is not None:
+                self.__pool.close()
+                self.__pool = None
+
+    def __generate_iv(self):
+        return random.randrange(2 ** (8 * self.__block_size - 1), 2 ** (8 * self.__block_size) - 1)
+
+    def __save_private_key(self, n, d, crt_params):
         '''
         This method saves a private key to a file in a
-        hesadecimal format.
+        hesadecimal format. The first two lines are the n and d
+        values, the following lines are the CRT parameters
+        (p, q, dP, dQ, qInv), followed by the (r_i, d_i, t_i) triples
+        of the additional primes of a multi-prime key.
         '''
 
         filename = self.__data_directory + "/" + self.__private_key_file
@@ -287,6 +1251,8 @@ class EncryptionModule:
         d_hex_str = self.__convert_int_to_hex_string(d)
         file.write(n_hex_str + "\n")
         file.write(d_hex_str + "\n")
+        for value in crt_params:
+            file.write(self.__convert_int_to_hex_string(value) + "\n")
         file.close()
 
     def __save_public_key(self, n, e):
@@ -305,25 +1271,96 @@ class EncryptionModule:
 
     def __load_private_key(self):
         '''
-        This method loads a private key from a file in which it was
-        saved in a hexadecimal format.
+        This method returns the private key, which is read from the
+        file only if it is not cached yet or the file has changed.
         '''
 
+        binary_filename = self.__data_directory + "/" + self.__private_key_binary_file
+        if os.path.isfile(binary_filename):
+            return self.__load_key(binary_filename, self.__read_binary_private_key)
         private_key_filename = self.__data_directory + "/" + self.__private_key_file
+        return self.__load_key(private_key_filename, self.__read_private_key)
+
+    def __load_public_key(self):
+        '''
+        This method returns the public key, which is read from the
+        file only if it is not cached yet or the file has changed.
+        '''
+
+        binary_filename = self.__data_directory + "/" + self.__public_key_binary_file
+        if os.path.isfile(binary_filename):
+            return self.__load_key(binary_filename, self.__read_binary_public_key)
+        public_key_filename = self.__data_directory + "/" + self.__public_key_file
+        return self.__load_key(public_key_filename, self.__read_public_key)
+
+    def __load_key(self, filename, read_key):
+        '''
+        This method returns a key from the cache. The cached key is
+        valid as long as the modification time and the size of its
+        file are unchanged, otherwise the file is read again.
+        '''
+
+        with self.__metrics.phase(metrics.KEY_LOAD):
+            stat = os.stat(filename)
+            cached = self.__key_cache.get(filename)
+            if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                return cached[2]
+
+            key = read_key(filename)
+            self.__key_cache[filename] = (stat.st_mtime_ns, stat.st_size, key)
+            return key
+
+    def __read_binary_public_key(self, filename):
+        public_key, private_key, modulus_length, fingerprint = self.__kf.read_key(filename)
+        self.__key_parameters[public_key[0]] = (modulus_length, fingerprint)
+        return public_key
+
+    def __read_binary_private_key(self, filename):
+        public_key, private_key, modulus_length, fingerprint = self.__kf.read_key(filename)
+        if private_key is None:
+            raise ValueError("Key file " + filename + " does not contain a private key.")
+        self.__key_parameters[public_key[0]] = (modulus_length, fingerprint)
+        return private_key
+
+    def __has_key_files(self, public_key_file, private_key_file):
+        return os.path.isfile(self.__data_directory + "/" + public_key_file) and os.path.isfile(self.__data_directory + "/" + private_key_file)
+
+    def __remove_key_files(self, public_key_file, private_key_file):
+        '''
+        This method removes the key files of the other format,
+        so that they are not loaded instead of the new keys.
+        '''
+
+        for filename in (public_key_file, private_key_file):
+            if os.path.isfile(self.__data_directory + "/" + filename):
+                os.remove(self.__data_directory + "/" + filename)
+
+    def __read_private_key(self, private_key_filename):
+        '''
+        This method loads a private key from a file in which it was
+        saved in a hexadecimal format. Key files generated before the
+        CRT parameters were stored contain only the n and d values,
+        in which case the CRT parameters are None.
+        '''
+
         file = open(private_key_filename, "r")    
         lines = file.read().splitlines()
         n = self.__convert_hex_string_to_int(lines[0])
         d = self.__convert_hex_string_to_int(lines[1])
+        crt_params = None
+        if len(lines) >= 7:
+            # The two-prime parameters and the whole triples of the additional primes
+            crt_length = 5 + (len(lines) - 7) // 3 * 3
+            crt_params = tuple(self.__convert_hex_string_to_int(line) for line in lines[2:2 + crt_length])
         file.close()
-        return (n, d)
+        return (n, d, crt_params)
 
-    def __load_public_key(self):
+    def __read_public_key(self, public_key_filename):
         '''
         This method loads a public key from a file in which it was
         saved in a hexadecimal format.
         '''
 
-        public_key_filename = self.__data_directory + "/" + self.__public_key_file
         file = open(public_key_filename, "r")    
         lines = file.read().splitlines()
         n = self.__convert_hex_string_to_int(lines[0])
@@ -0,0 +1,169 @@
+import os
+import sys
+import mmap
+import struct
+import argparse
+
+from .ciphertext_format import CiphertextFormat
+
+class KeyFormat:
+    '''
+    Versioned binary key file format:
+    1) magic bytes b"RSAK" and the format version (1 byte),
+    2) kind of the key, 0 for public and 1 for private (1 byte),
+    3) number of primes of the modulus, 0 for a private key saved
+       without the CRT parameters (1 byte),
+    4) byte length of the modulus (2 bytes, big-endian),
+    5) the 8 byte fingerprint of the key,
+    6) byte lengths of the values (2 bytes each, big-endian),
+    7) the values as big-endian integers: n and e, followed in a private
+       key by d and the CRT parameters (p, q, dP, dQ, qInv and the
+       (r_i, d_i, t_i) triples of the additional primes).
+    The modulus length and the fingerprint are stored, so that loading
+    a key does not compute anything, and the file is read through mmap.
+    '''
+
+    MAGIC = b"RSAK"
+    VERSION = 1
+    PUBLIC = 0
+    PRIVATE = 1
+
+    __HEADER_STRUCT = struct.Struct(">4sBBBH")
+
+    def pack_public_key(self, public_key):
+        n, e = public_key
+        return self.__pack(self.PUBLIC, 2, n, (n, e))
+
+    def pack_private_key(self, public_key, private_key):
+        n, e = public_key
+        n, d, crt_params = private_key
+        if crt_params is None:
+            return self.__pack(self.PRIVATE, 0, n, (n, e, d))
+        return self.__pack(self.PRIVATE, 2 + (len(crt_params) - 5) // 3, n, (n, e, d) + tuple(crt_params))
+
+    def unpack(self, data):
+        '''
+        This method returns the public key (n, e), the private key (n, d,
+        crt_params) or None for a public key file, the modulus length and
+        the fingerprint. A ValueError is raised if the data is not a valid
+        key file.
+        '''
+
+        if len(data) < self.__HEADER_STRUCT.size + CiphertextFormat.FINGERPRINT_LENGTH:
+            raise ValueError("Key file is too short.")
+        magic, version, kind, primes_count, modulus_length = self.__HEADER_STRUCT.unpack_from(data)
+        if magic != self.MAGIC:
+            raise ValueError("Not a binary key file.")
+        if version != self.VERSION:
+            raise ValueError("Unsupported key file format version: " + str(version))
+        if kind != self.PUBLIC and kind != self.PRIVATE:
+            raise ValueError("Invalid key file header.")
+
+        offset = self.__HEADER_STRUCT.size
+        fingerprint = bytes(data[offset:offset + CiphertextFormat.FINGERPRINT_LENGTH])
+        offset += CiphertextFormat.FINGERPRINT_LENGTH
+
+        count = self.__get_values_count(kind, primes_count)
+        lengths_struct = struct.Struct(">" + str(count) + "H")
+        if len(data) < offset + lengths_struct.size:
+            raise ValueError("Key file is too short.")
+        lengths = lengths_struct.unpack_from(data, offset)
+        offset += lengths_struct.size
+        if len(data) != offset + sum(lengths):
+            raise ValueError("Key file is truncated.")
+
+        values = list()
+        for length in lengths:
+            values.append(int.from_bytes(data[offset:offset + length], "big"))
+            offset += length
+
+        n, e = values[0], values[1]
+        if (n.bit_length() + 7) // 8 != modulus_length:
+            raise ValueError("Invalid key file header.")
+        if kind == self.PUBLIC:
+            return (n, e), None, modulus_length, fingerprint
+        crt_params = tuple(values[3:]) if primes_count > 0 else None
+        return (n, e), (n, values[2], crt_params), modulus_length, fingerprint
+
+    def read_key(self, filename):
+        '''
+        This method reads a binary key file through a read-only memory map.
+        '''
+
+        with open(filename, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                raise ValueError("Key file is too short.")
+            with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+                return self.unpack(data)
+
+    def write_key(self, filename, data):
+        '''
+        This method writes a key file, which is renamed into
+        place only when it is complete.
+        '''
+
+        file = open(filename + ".tmp", "wb")
+        file.write(data)
+        file.close()
+        os.replace(filename + ".tmp", filename)
+
+    def convert(self, public_text_filename, private_text_filename, public_filename, private_filename):
+        '''
+        This method converts a pair of key files in the hexadecimal text
+        format (one value per line: n and e, or n, d and the CRT parameters)
+        to the binary format. The text files are left in place.
+        '''
+
+        public_values = self.__read_hex_values(public_text_filename)
+        private_values = self.__read_hex_values(private_text_filename)
+        if len(public_values) < 2 or len(private_values) < 2 or public_values[0] != private_values[0]:
+            raise ValueError("Text key files do not contain a pair of keys.")
+
+        public_key = (public_values[0], public_values[1])
+        crt_params = None
+        if len(private_values) >= 7:
+            crt_params = tuple(private_values[2:2 + 5 + (len(private_values) - 7) // 3 * 3])
+        private_key = (private_values[0], private_values[1], crt_params)
+
+        self.write_key(public_filename, self.pack_public_key(public_key))
+        self.write_key(private_filename, self.pack_private_key(public_key, private_key))
+
+    def __pack(self, kind, primes_count, n, values):
+        modulus_length = (n.bit_length() + 7) // 8
+        encoded_values = [value.to_bytes((value.bit_length() + 7) // 8, "big") for value in values]
+        header = self.__HEADER_STRUCT.pack(self.MAGIC, self.VERSION, kind, primes_count, modulus_length) + CiphertextFormat.calculate_fingerprint(n)
+        lengths = struct.pack(">" + str(len(values)) + "H", *[len(value) for value in encoded_values])
+        return header + lengths + b"".join(encoded_values)
+
+    def __get_values_count(self, kind, primes_count):
+        if kind == self.PUBLIC:
+            return 2
+        if primes_count == 0:
+            return 3
+        if primes_count < 2:
+            raise ValueError("Invalid key file header.")
+        return 3 + 5 + 3 * (primes_count - 2)
+
+    def __read_hex_values(self, filename):
+        file = open(filename, "r")
+        values = [int(line, 16) for line in file.read().splitlines() if len(line.strip()) > 0]
+        file.close()
+        return values
+
+def main():
+    parser = argparse.ArgumentParser(description = "Convert the text key files of a data directory to the binary key format.")
+    parser.add_argument("--data-directory", default = "./data", help = "directory with the public_key.txt and private_key.txt files")
+    args = parser.parse_args()
+
+    directory = args.data_directory
+    KeyFormat().convert(
+        directory + "/public_key.txt",
+        directory + "/private_key.txt",
+        directory + "/public_key.bin",
+        directory + "/private_key.bin"
+    )
+    print("[INFO] Converted the key files in " + directory)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import os
+import time
+import threading
+import collections
+import concurrent.futures
+
+from .math_module import MathModule
+from .ciphertext_format import CiphertextFormat
+
+def _generate_key_pair(bits, primality_test, prime_search, public_exponent, primes_count, processes, backend):
+    mm = MathModule(primality_test = primality_test, prime_search = prime_search, backend = backend)
+    return mm.generate_rsa_key_pair(bits, processes, public_exponent, primes_count)
+
+class KeyPool:
+    '''
+    A pool of pre-generated pairs of keys. Background threads keep the pool
+    filled up to its size, each of them running the key generation in a
+    worker process, so the generation does not hold up the caller's thread.
+    Every ready pair is also spooled to a file in the spool directory
+    (and removed from there when taken), and the spooled pairs are
+    loaded back when a new pool is started.
+    '''
+
+    def __init__(self, size, bits, spool_directory, workers = 1, primality_test = "miller_rabin", prime_search = "incremental", public_exponent = 65537, primes_count = 2, processes = 1, backend = None):
+        if not isinstance(size, int) or size < 1:
+            raise ValueError("Size of the pool of keys has to be a positive integer.")
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("Number of workers has to be a positive integer.")
+
+        self.__size = size
+        self.__bits = bits
+        self.__spool_directory = spool_directory
+        self.__primality_test = primality_test
+        self.__prime_search = prime_search
+        self.__public_exponent = public_exponent  # None for a random exponent
+        self.__primes_count = primes_count
+        self.__processes = processes    # processes searching for the primes of one pair
+        self.__backend = backend
+
+        self.__keys = collections.deque()  # (public_key, private_key, spool_filename)
+        self.__pending = 0
+        self.__generated_count = 0
+        self.__generation_time = 0.0
+        self.__start_time = time.perf_counter()
+        self.__running = True
+        self.__condition = threading.Condition()
+
+        if not os.path.isdir(self.__spool_directory):
+            os.makedirs(self.__spool_directory)
+        self.__load_spooled_keys()
+
+        self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers = workers)
+        self.__threads = [threading.Thread(target = self.__refill, daemon = True) for i in range(workers)]
+        for thread in self.__threads:
+            thread.start()
+
+    def take(self, timeout = None):
+        '''
+        This method returns a ready pair of keys (public_key, private_key)
+        and removes it from the pool. If the pool is empty it waits for the
+        next generated pair; a TimeoutError is raised after timeout seconds.
+        '''
+
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: len(self.__keys) > 0 or not self.__running, timeout):
+                raise TimeoutError("No pair of keys is ready.")
+            if len(self.__keys) == 0:
+                raise RuntimeError("The pool of keys is stopped.")
+            public_key, private_key, filename = self.__keys.popleft()
+            self.__condition.notify_all()
+
+        if os.path.isfile(filename):
+            os.remove(filename)
+        return public_key, private_key
+
+    def get_stats(self):
+        '''
+        This method returns the size and the fill level of the pool, the number
+        of pairs generated since it was started, the average generation rate
+        (pairs per second) and the average time of generating one pair.
+        '''
+
+        with self.__condition:
+            elapsed = time.perf_counter() - self.__start_time
+            return {
+                "size": self.__size,
+                "ready": len(self.__keys),
+                "fill_level": len(self.__keys) / self.__size,
+                "pending": self.__pending,
+                "generated": self.__generated_count,
+                "generation_rate": self.__generated_count / elapsed if elapsed > 0 else 0.0,
+                "average_generation_time": self.__generation_time / self.__generated_count if self.__generated_count > 0 else None
+            }
+
+    def stop(self):
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify_all()
+        self.__executor.shutdown(wait = False, cancel_futures = True)
+
+    def __refill(self):
+        '''
+        The loop of a background thread: whenever the pool (together with the
+        pairs being generated) is not full, generate one more pair.
+        '''
+
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: not self.__running or len(self.__keys) + self.__pending < self.__size)
+                if not self.__running:
+                    return
+                self.__pending += 1
+
+            start_time = time.perf_counter()
+            try:
+                future = self.__executor.submit(_generate_key_pair, self.__bits, self.__primality_test, self.__prime_search, self.__public_exponent, self.__primes_count, self.__processes, self.__backend)
+                public_key, private_key = future.result()
+            except (concurrent.futures.CancelledError, RuntimeError):
+                # The executor was shut down
+                with self.__condition:
+                    self.__pending -= 1
+                return
+            finish_time = time.perf_counter()
+
+            filename = self.__spool_key_pair(public_key, private_key)
+            with self.__condition:
+                self.__pending -= 1
+                self.__generated_count += 1
+                self.__generation_time += finish_time - start_time
+                self.__keys.append((public_key, private_key, filename))
+                self.__condition.notify_all()
+
+    def __spool_key_pair(self, public_key, private_key):
+        '''
+        This method saves a pair of keys in a hexadecimal format: the n, e and d
+        values followed by the CRT parameters, one value per line. The file is
+        named after the fingerprint of the key and renamed into place only
+        when it is complete.
+        '''
+
+        n, e = public_key
+        n, d, crt_params = private_key
+        filename = self.__spool_directory + "/" + CiphertextFormat.calculate_fingerprint(n).hex() + ".key"
+        file = open(filename + ".tmp", "w")
+        for value in (n, e, d) + tuple(crt_params):
+            file.write(hex(value)[2:] + "\n")
+        file.close()
+        os.replace(filename + ".tmp", filename)
+        return filename
+
+    def __load_spooled_keys(self):
+        for name in sorted(os.listdir(self.__spool_directory)):
+            if not name.endswith(".key"):
+                continue
+            filename = self.__spool_directory + "/" + name
+            file = open(filename, "r")
+            values = [int(line, 16) for line in file.read().splitlines()]
+            file.close()
+            n, e, d = values[:3]
+            # Pairs spooled by a pool generating keys of a different size, with
+            # a different number of primes or public exponent are left alone
+            if n.bit_length() != 2 * self.__bits:
+                continue
+            if len(values) != 3 + 5 + 3 * (self.__primes_count - 2):
+                continue
+            if self.__public_exponent is not None and e != self.__public_exponent:
+                continue
+            self.__keys.append(((n, e), (n, d, tuple(values[3:])), filename))
@@ -1,34 +1,265 @@
 import os
 import random
 import math
+import itertools
+import concurrent.futures
 import numpy as np
 
 import sys
 
-class MathModule:
-    def __init__(self):
-        self.__data_directory = "./data"
-        self.__primes_file = "primes.txt"
-        self.__generated_primes_count = 100000
+# gmpy2 (GMP) is optional, without it the pure-Python arithmetic is used
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
 
-        self.__generate_primes_file()
+def _python_powmod(base, exponent, modulus):
+    return pow(base, exponent, modulus)
 
-        # Load first few hundred primes
-        self.__first_primes = self.__load_first_few_hundred_primes(500)
+def _gmpy2_powmod(base, exponent, modulus):
+    return int(gmpy2.powmod(base, exponent, modulus))
 
-    def generate_large_prime(self, n):
+def _generate_prime_in_process(n, primality_test, prime_search, public_exponent, backend, minimum = None):
+    '''
+    Generates a single prime in a separate process (see generate_large_primes)
+    and returns it together with the prime search counters of that process.
+    '''
+
+    mm = MathModule(primality_test = primality_test, prime_search = prime_search, backend = backend)
+    prime = mm.generate_large_prime(n, public_exponent, minimum)
+    return prime, mm.get_prime_search_stats()
+
+class MathModule:
+    # Minimum number of Miller-Rabin rounds for a given bit length of the
+    # candidate (FIPS 186-4, Appendix C.3, Table C.3), as (bits, rounds) pairs.
+    # Candidates shorter than the smallest entry get 40 rounds.
+    MILLER_RABIN_ROUNDS = [(1536, 4), (1024, 5), (512, 5)]
+    # Maximum number of primes of a multi-prime modulus of a given bit length,
+    # as (bits, primes) pairs. Shorter moduli have only 2 primes.
+    MAX_PRIMES_COUNTS = [(4096, 4), (1024, 3)]
+    PRIMALITY_TESTS = ["miller_rabin", "baillie_psw", "legacy"]
+    PRIME_SEARCHES = ["incremental", "random"]
+    BACKENDS = ["python", "gmpy2"]
+
+    @staticmethod
+    def is_backend_available(backend):
+        return backend == "python" or (backend == "gmpy2" and gmpy2 is not None)
+
+    @staticmethod
+    def get_default_backend():
+        return "gmpy2" if gmpy2 is not None else "python"
+
+    @staticmethod
+    def get_max_primes_count(modulus_bits):
+        for min_bits, primes_count in MathModule.MAX_PRIMES_COUNTS:
+            if modulus_bits >= min_bits:
+                return primes_count
+        return 2
+
+    @staticmethod
+    def get_powmod(backend = None):
+        '''
+        This method returns the function calculating base^exponent mod modulus
+        (as a Python int) with the given arithmetic backend (the default
+        one if it is None).
+        '''
+
+        if backend is None:
+            backend = MathModule.get_default_backend()
+        if backend == "gmpy2":
+            return _gmpy2_powmod
+        return _python_powmod
+
+    def __init__(self, primes_count = 100000, primality_test = "miller_rabin", prime_search = "incremental", backend = None):
+        self.__data_directory = "./data"
+        self.__primes_file = "primes.txt"
+        self.__generated_primes_count = primes_count
+        self.__sieve_segment_size = 2 ** 18
+        self.__primality_test = "miller_rabin"
+        self.set_primality_test(primality_test)
+        self.__prime_search = "incremental"
+        self.set_prime_search(prime_search)
+        self.__prime_search_window = 4096   # number of odd offsets sieved at once by the incremental search
+        self.__prime_search_sieve_limit = 2 ** 16   # the window is sieved by all of the primes below this limit
+        self.__sieving_primes = None
+
+        # Arithmetic backend: "gmpy2" if it is installed, "python" otherwise
+        self.__backend = self.get_default_backend()
+        if backend is not None:
+            self.set_backend(backend)
+        self.__powmod = self.get_powmod(self.__backend)
+
+        # Both the primes file and the first few hundred primes
+        # are generated lazily, when they are needed for the first time
+        self.__primes_file_checked = False
+        self.__first_primes_count = 500
+        self.__first_primes = None
+        self.__first_primes_product = None
+
+        # Counters of the prime search (see get_prime_search_stats)
+        self.__prime_search_stats = dict()
+        self.reset_prime_search_stats()
+
+    def generate_large_prime(self, n, public_exponent = None, minimum = None):
         '''
         This method generates a large prime,
-        which has n bit length
+        which has n bit length. If a public exponent e is given,
+        then primes p for which gcd(e, p - 1) != 1 are skipped,
+        since e would have no inverse modulo phi for them.
+        If a minimum is given, the prime is not smaller than it.
         '''
 
+        while True:
+            prime = self.__generate_large_prime(n, minimum)
+            if public_exponent is None or math.gcd(public_exponent, prime - 1) == 1:
+                return prime
+
+    def __generate_large_prime(self, n, minimum):
+        if self.__prime_search == "incremental" and n > self.__prime_search_sieve_limit.bit_length() + 1:
+            return self.__generate_large_prime_incrementally(n, minimum)
+
         prime_candidate = 0
         while True:
-            prime_candidate = self.__get_low_level_prime(n)
-            if self.__is_miller_rabin_passed(prime_candidate):
+            prime_candidate = self.__get_low_level_prime(n, minimum)
+            if self.__is_high_level_test_passed(prime_candidate):
                 break
+            self.__prime_search_stats["miller_rabin_rejected"] += 1
+        self.__prime_search_stats["primes_found"] += 1
         return prime_candidate
 
+    def generate_large_primes(self, n, count, processes = 1, public_exponent = None):
+        '''
+        This method generates count distinct primes of n bit length (suitable
+        for the public exponent, see generate_large_prime). With more
+        than one process the primes are searched for at the same time in
+        separate processes; their prime search counters are added to the
+        counters of this module.
+        '''
+
+        return self.__generate_distinct_primes([(n, None)] * count, processes, public_exponent)
+
+    def __generate_distinct_primes(self, sizes, processes, public_exponent):
+        '''
+        This method generates one prime for every (bit length, minimum)
+        pair of sizes, all of them distinct, in the same order.
+        '''
+
+        primes = [None] * len(sizes)
+        while None in primes:
+            missing = [i for i in range(len(sizes)) if primes[i] is None]
+            if processes < 2 or len(missing) < 2:
+                for i in missing:
+                    primes[i] = self.generate_large_prime(sizes[i][0], public_exponent, sizes[i][1])
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers = min(processes, len(missing))) as executor:
+                    futures = [executor.submit(_generate_prime_in_process, sizes[i][0], self.__primality_test, self.__prime_search, public_exponent, self.__backend, sizes[i][1]) for i in missing]
+                    for i, future in zip(missing, futures):
+                        primes[i], stats = future.result()
+                        for key in stats:
+                            self.__prime_search_stats[key] += stats[key]
+            for i in missing:
+                if primes[i] in primes[:i] + primes[i + 1:]:
+                    primes[i] = None
+        return primes
+
+    def get_backend(self):
+        return self.__backend
+
+    def set_backend(self, backend):
+        '''
+        This method chooses the arithmetic backend of the modular
+        exponentiation, the modular inverse, the primality tests and
+        the next prime search: "gmpy2" (GMP, needs gmpy2 to be installed)
+        or "python" (the built-in integers and the code of this module).
+        '''
+
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown arithmetic backend: " + str(backend))
+        if not self.is_backend_available(backend):
+            raise ValueError("Arithmetic backend " + backend + " needs gmpy2 to be installed.")
+        self.__backend = backend
+        self.__powmod = self.get_powmod(backend)
+
+    def powmod(self, base, exponent, modulus):
+        return self.__powmod(base, exponent, modulus)
+
+    def get_prime_search(self):
+        return self.__prime_search
+
+    def set_prime_search(self, prime_search):
+        '''
+        This method chooses how the prime candidates are obtained: "incremental"
+        (the odd numbers following one random starting point, sieved in windows
+        by the first primes) or "random" (a new random number for every candidate).
+        '''
+
+        if prime_search not in self.PRIME_SEARCHES:
+            raise ValueError("Unknown prime search: " + str(prime_search))
+        self.__prime_search = prime_search
+
+    def get_primality_test(self):
+        return self.__primality_test
+
+    def set_primality_test(self, primality_test):
+        '''
+        This method chooses the high-level primality test: "miller_rabin"
+        (number of rounds depending on the bit length), "baillie_psw"
+        (Miller-Rabin with base 2 and the strong Lucas test) or "legacy"
+        (the original 20 rounds of Miller-Rabin, kept for comparison).
+        '''
+
+        if primality_test not in self.PRIMALITY_TESTS:
+            raise ValueError("Unknown primality test: " + str(primality_test))
+        self.__primality_test = primality_test
+
+    def is_probable_prime(self, candidate):
+        '''
+        This method tests whether a number is (probably) prime: first it is
+        checked against the first few hundred primes and then tested with
+        the chosen high-level primality test.
+        '''
+
+        if candidate < 2:
+            return False
+        first_primes = self.__get_first_primes()
+        if candidate <= first_primes[-1]:
+            return candidate in first_primes
+        if math.gcd(candidate, self.__get_first_primes_product()) != 1:
+            return False
+        return self.__is_high_level_test_passed(candidate)
+
+    def next_prime(self, n):
+        '''
+        This method returns the smallest probable prime greater than n.
+        '''
+
+        if self.__backend == "gmpy2":
+            return int(gmpy2.next_prime(n))
+        if n < 2:
+            return 2
+        candidate = n + 1 + n % 2
+        while not self.is_probable_prime(candidate):
+            candidate += 2
+        return candidate
+
+    def get_prime_search_stats(self):
+        '''
+        This method returns the counters of the prime search: the number
+        of random candidates tried, the number of candidates rejected by the
+        small primes screening, the number of candidates rejected by the
+        Miller-Rabin test and the number of primes found.
+        '''
+
+        return dict(self.__prime_search_stats)
+
+    def reset_prime_search_stats(self):
+        self.__prime_search_stats = {
+            "candidates": 0,
+            "screened_out": 0,
+            "miller_rabin_rejected": 0,
+            "primes_found": 0
+        }
+
     def choose_random_primes(self):
             '''
             This method chooses two random primes from
@@ -39,15 +270,18 @@ class MathModule:
             from the subset of the pre-generated primes.
             '''
 
+            self.__generate_primes_file()
+
             try:
                 filename = self.__data_directory + "/" + self.__primes_file
                 file = open(filename, "r")
 
                 # Choosing two relatively big prime numbers from the generated file
-                rand_1 = random.randint(int(0.8 * self.__generated_primes_count), self.__generated_primes_count)
-                rand_2 = random.randint(int(0.8 * self.__generated_primes_count), self.__generated_primes_count)
+                rand_1 = random.randint(int(0.8 * self.__generated_primes_count), self.__generated_primes_count - 1)
+                rand_2 = random.randint(int(0.8 * self.__generated_primes_count), self.__generated_primes_count - 1)
 
-                lines = file.read().splitlines()
+                # Only the lines up to the larger of the chosen indices are read
+                lines = list(itertools.islice(file, max(rand_1, rand_2) + 1))
 
                 prime_1 = int(lines[rand_1])
                 prime_2 = int(lines[rand_2])
@@ -65,9 +299,12 @@ class MathModule:
     def calculate_multiplicative_inverse(self, e, phi):
         '''
         This method returns the multiplicative inverse of number n
-        using the Extended Euclidean algorithm.
+        using the Extended Euclidean algorithm (or GMP with the gmpy2 backend).
         '''
 
+        if self.__backend == "gmpy2":
+            return int(gmpy2.invert(e, phi))
+
         gcd, x, y = self.__extended_gcd(e, phi)
         # If the coefficient x turns out to be negative
         # then we increase it by phi value, which is the
@@ -79,36 +316,284 @@ class MathModule:
             x += phi
         return x
 
-    def __get_low_level_prime(self, n):
+    def generate_rsa_key_pair(self, bits, processes = 1, public_exponent = 65537, primes_count = 2):
+        '''
+        This method generates a pair of RSA keys with a modulus of exactly
+        2 * bits bits (searching for the primes in parallel if processes > 1)
+        and returns the public key (n, e) and the private key (n, d, crt_params).
+        With primes_count > 2 the modulus is a product of that many smaller
+        primes (multi-prime RSA, RFC 8017), which are cheaper to find; a
+        ValueError is raised if there are more of them than get_max_primes_count
+        allows for the modulus size.
+        The public exponent e is the given one (the primes are retried until
+        gcd(e, phi) = 1) or, if it is None, a random value chosen by
+        choose_encryption_value.
+        '''
+
+        if not isinstance(primes_count, int) or primes_count < 2:
+            raise ValueError("Number of primes has to be an integer of at least 2.")
+        if primes_count > self.get_max_primes_count(2 * bits):
+            raise ValueError("Too many primes for a " + str(2 * bits) + "-bit modulus.")
+        primes = self.__generate_distinct_primes(self.__get_prime_sizes(2 * bits, primes_count), processes, public_exponent)
+        p, q = primes[:2]
+
+        n = 1
+        phi = 1
+        for prime in primes:
+            n *= prime
+            phi *= prime - 1
+
+        if public_exponent is None:
+            e = self.choose_encryption_value(phi)
+        else:
+            e = public_exponent
+        d = self.calculate_multiplicative_inverse(e, phi)
+
+        # Chinese Remainder Theorem parameters used to speed up decryption
+        crt_params = self.calculate_crt_parameters(p, q, d, primes[2:])
+
+        return (n, e), (n, d, crt_params)
+
+    def __get_prime_sizes(self, modulus_bits, primes_count):
         '''
-        Generate a prime candidate divisible by first primes.
+        This method splits the bits of the modulus between the primes (the
+        first ones get the remainder) and returns their (bit length, minimum)
+        pairs. Every prime of b bits is at least 2^(b - 1/primes_count)
+        (and has its two top bits set), so that their product has
+        exactly modulus_bits bits.
         '''
 
+        sizes = list()
+        for i in range(primes_count):
+            bits = modulus_bits // primes_count + (1 if i < modulus_bits % primes_count else 0)
+            minimum = max(3 << (bits - 2), self.__integer_root(1 << (primes_count * bits - 1), primes_count) + 1)
+            sizes.append((bits, minimum))
+        return sizes
+
+    def __integer_root(self, value, k):
+        '''
+        This method returns the integer part of the k-th root of the value
+        (Newton's method, starting above the root).
+        '''
+
+        root = 1 << ((value.bit_length() + k - 1) // k)
         while True:
-            # Obtain a random n-bit number
-            prime_candidate = self.__generate_n_bit_random(n)
+            next_root = ((k - 1) * root + value // root ** (k - 1)) // k
+            if next_root >= root:
+                return root
+            root = next_root
+
+    def choose_encryption_value(self, phi):
+        '''
+        This method chooses an encryption value between
+        1 and phi exclusive, which is relatively prime with phi.
+        '''
+
+        while True:
+            e = random.randrange(2, phi)
+            if (math.gcd(e, phi) == 1):
+                break
+        return e
+
+    def calculate_crt_parameters(self, p, q, d, additional_primes = ()):
+        '''
+        This method calculates the Chinese Remainder Theorem parameters
+        of a private key (PKCS #1): dP = d mod (p - 1), dQ = d mod (q - 1)
+        and qInv being the multiplicative inverse of q modulo p. A multi-prime
+        key also gets a triple (r_i, d_i, t_i) for every additional prime r_i:
+        d_i = d mod (r_i - 1) and t_i being the multiplicative inverse
+        of the product of the previous primes modulo r_i.
+        '''
+
+        dp = d % (p - 1)
+        dq = d % (q - 1)
+        q_inv = self.calculate_multiplicative_inverse(q, p)
+        crt_params = (p, q, dp, dq, q_inv)
+
+        product = p * q
+        for prime in additional_primes:
+            crt_params += (prime, d % (prime - 1), self.calculate_multiplicative_inverse(product % prime, prime))
+            product *= prime
+        return crt_params
+
+    @staticmethod
+    def crt_pow(value, crt_params, backend = None):
+        '''
+        This method calculates value^d mod n using the Chinese Remainder
+        Theorem (Garner's recombination). Both exponentiations are done
+        with half-size moduli and exponents, which makes it roughly
+        3-4 times faster than a single pow(value, d, n). The additional
+        primes of a multi-prime key are added one by one (RFC 8017, 5.1.2),
+        each with an exponentiation modulo the prime.
+        '''
+
+        powmod = MathModule.get_powmod(backend)
+        p, q, dp, dq, q_inv = crt_params[:5]
+        m_1 = powmod(value, dp, p)
+        m_2 = powmod(value, dq, q)
+        h = (q_inv * (m_1 - m_2)) % p
+        m = m_2 + h * q
+
+        product = p * q
+        for i in range(5, len(crt_params), 3):
+            prime, d_i, t_i = crt_params[i:i + 3]
+            m_i = powmod(value, d_i, prime)
+            h = ((m_i - m) * t_i) % prime
+            m += product * h
+            product *= prime
+        return m
+
+    @staticmethod
+    def private_pow(value, private_key, backend = None):
+        '''
+        This method calculates value^d mod n for a private key (n, d, crt_params).
+        The CRT is used when the key carries its parameters, otherwise
+        it falls back to the plain pow(value, d, n).
+        '''
+
+        n, d, crt_params = private_key
+        if crt_params is None:
+            return MathModule.get_powmod(backend)(value, d, n)
+        return MathModule.crt_pow(value, crt_params, backend)
+
+    def __get_low_level_prime(self, n, minimum = None):
+        '''
+        Generate a prime candidate not divisible by any of the first primes.
+        Instead of dividing the candidate by every one of them, a single gcd
+        with their product is calculated - the candidate has no small prime
+        factors if and only if the gcd is equal to 1.
+        '''
+
+        first_primes_product = self.__get_first_primes_product()
+        while True:
+            # Obtain a random odd n-bit number
+            prime_candidate = self.__generate_n_bit_random(n, minimum) | 1
+            self.__prime_search_stats["candidates"] += 1
 
             # Low-level primality testing
-            for divisor in self.__first_primes:
-                if prime_candidate % divisor == 0 and divisor ** 2 <= prime_candidate:
-                    break                
-                else:
+            if math.gcd(prime_candidate, first_primes_product) == 1:
+                return prime_candidate
+            if prime_candidate <= self.__get_first_primes()[-1] and prime_candidate in self.__get_first_primes():
+                return prime_candidate
+            self.__prime_search_stats["screened_out"] += 1
+
+    def __generate_large_prime_incrementally(self, n, minimum = None):
+        '''
+        This method picks one random odd n-bit starting point and sieves the
+        window of the following odd numbers (start + 2 * i) by all of the primes
+        below __prime_search_sieve_limit (many more than the first primes used by
+        the random search, since sieving a whole window costs only one slice
+        assignment per prime). Only the survivors of the sieve are tested with
+        the high-level test. If the window contains no prime a new starting
+        point is drawn.
+        '''
+
+        if self.__sieving_primes is None:
+            self.__sieving_primes = self.__sieve_primes(self.__prime_search_sieve_limit)[1:]    # odd primes only
+        sieving_primes = self.__sieving_primes
+        window = self.__prime_search_window
+        while True:
+            start = self.__generate_n_bit_random(n, minimum) | 1
+            sieve = bytearray([1]) * window
+            for prime in sieving_primes:
+                # start + 2 * i = 0 (mod prime) <=> i = -start * 2^(-1) (mod prime)
+                i = (-start * ((prime + 1) // 2)) % prime
+                sieve[i::prime] = bytes(len(range(i, window, prime)))
+
+            for i in range(window):
+                prime_candidate = start + 2 * i
+                if prime_candidate.bit_length() > n:
+                    break
+                self.__prime_search_stats["candidates"] += 1
+                if not sieve[i]:
+                    self.__prime_search_stats["screened_out"] += 1
+                    continue
+                if self.__is_high_level_test_passed(prime_candidate):
+                    self.__prime_search_stats["primes_found"] += 1
                     return prime_candidate
+                self.__prime_search_stats["miller_rabin_rejected"] += 1
+
+    def __generate_n_bit_random(self, n, minimum = None):
+        if minimum is None:
+            minimum = 2 ** (n - 1) + 1
+        return random.randrange(minimum, 2 ** n - 1)
+
+    def __is_high_level_test_passed(self, candidate):
+        if self.__backend == "gmpy2" and self.__primality_test != "legacy":
+            return self.__is_gmpy2_test_passed(candidate)
+        if self.__primality_test == "baillie_psw":
+            return self.__is_baillie_psw_passed(candidate)
+        if self.__primality_test == "legacy":
+            return self.__is_legacy_miller_rabin_passed(candidate)
+        return self.__is_miller_rabin_passed(candidate, self.__get_miller_rabin_rounds(candidate.bit_length()))
+
+    def __is_gmpy2_test_passed(self, candidate):
+        '''
+        The Miller-Rabin and Baillie-PSW tests done by GMP: the same number
+        of rounds with random bases in [2, candidate - 2], or the strong BPSW
+        test. A base sharing a factor with the candidate proves it composite
+        (and GMP does not accept such a base).
+        '''
+
+        if self.__primality_test == "baillie_psw":
+            return gmpy2.is_strong_bpsw_prp(candidate)
+        for i in range(self.__get_miller_rabin_rounds(candidate.bit_length())):
+            base = random.randrange(2, candidate - 1)
+            if math.gcd(candidate, base) != 1:
+                return False
+            if not gmpy2.is_strong_prp(candidate, base):
+                return False
+        return True
 
-    def __generate_n_bit_random(self, n):
-        return random.randrange(2 ** (n - 1) + 1, 2 ** n - 1)
+    def __get_miller_rabin_rounds(self, bits):
+        for min_bits, rounds in self.MILLER_RABIN_ROUNDS:
+            if bits >= min_bits:
+                return rounds
+        return 40
 
-    def __is_miller_rabin_passed(self, candidate):
+    def __is_miller_rabin_passed(self, candidate, trials_count, round_testers = None):
         '''
         This method is an implementation of high-level Rabin Miller Primality Test.
         When a prime candidate passes the low-level test it is then tested again
         with the Rabin Miller Test. Checking if a chosen extremely large number
         is prime in a deterministic way is highly impractical. A probabilistic
         approach is preferred. If an inputted value passes a single iteration of
-        the Rabin Miller test, the probability of the number being prime is 75%.
-        When the test is passed a number of times it can be considered to be a prime
-        with a satisfactory level of probability.
-        The error probability has to be less than (1/2)^128. 
+        the Rabin Miller test, the probability of the number being prime is 75%
+        (and for random large candidates much more than that, which is why the
+        number of rounds depends on the bit length, see MILLER_RABIN_ROUNDS).
+        In every round the value a^(d * 2^i) is obtained by squaring the previous
+        one instead of being recomputed from scratch.
+        The round testers are random, unless they are given explicitly.
+        '''
+
+        max_div_by_two = 0
+        even_component = candidate - 1
+
+        while even_component % 2 == 0:
+            even_component >>= 1
+            max_div_by_two += 1
+
+        def trial_composite(round_tester):
+            x = self.__powmod(round_tester, even_component, candidate)
+            if x == 1 or x == candidate - 1:
+                return False
+            for i in range(max_div_by_two - 1):
+                x = x * x % candidate
+                if x == candidate - 1:
+                    return False
+            return True
+
+        if round_testers is None:
+            round_testers = (random.randrange(2, candidate - 1) for i in range(trials_count))
+        for round_tester in round_testers:
+            if trial_composite(round_tester):
+                return False
+        return True
+
+    def __is_legacy_miller_rabin_passed(self, candidate):
+        '''
+        The original implementation of the Miller-Rabin test: always 20 rounds,
+        every power a^(d * 2^i) is computed with a separate exponentiation.
         '''
 
         # Running 20 iterations of Rabin Miller Primality test
@@ -122,10 +607,10 @@ class MathModule:
         assert(2 ** max_div_by_two * even_component == candidate - 1)
 
         def trial_composite(round_tester):
-            if pow(round_tester, even_component, candidate) == 1:
+            if self.__powmod(round_tester, even_component, candidate) == 1:
                 return False
             for i in range(max_div_by_two):
-                if pow(round_tester, 2 ** i * even_component, candidate) == candidate - 1:
+                if self.__powmod(round_tester, 2 ** i * even_component, candidate) == candidate - 1:
                     return False
             return True
 
@@ -134,33 +619,93 @@ class MathModule:
             if trial_composite(round_tester):
                 return False
         return True
-    
-    def __is_prime(self, n):
+
+    def __is_baillie_psw_passed(self, candidate):
         '''
-        All primes are not divisible by 2 (they are odd numbers).
-        All primes greater than 3 are of the form: 6n ± 1, and because
-        of that we start by checking the divisors from d = 5 (inclusive).
-        Then, we test whether n is divisible by d and d + 2,
-        each time we increment d by 6.
+        Baillie-PSW primality test: a strong probable prime test to base 2
+        followed by a strong Lucas probable prime test. No composite number
+        passing both of them is known.
         '''
 
-        if n == 2 or n == 3:
-            return True
-        if n < 2 or n % 2 == 0:
+        if not self.__is_miller_rabin_passed(candidate, 1, [2]):
             return False
-        if n < 9:
-            return True
-        if n % 3 == 0:
+        return self.__is_strong_lucas_passed(candidate)
+
+    def __is_strong_lucas_passed(self, n):
+        '''
+        Strong Lucas probable prime test with the parameters chosen by
+        Selfridge's method A: D is the first of 5, -7, 9, -11, ... for which
+        the Jacobi symbol (D/n) = -1, P = 1 and Q = (1 - D) / 4.
+        n + 1 = d * 2^s (d odd) and n passes if U_d = 0 (mod n)
+        or V_(d * 2^r) = 0 (mod n) for some 0 <= r < s.
+        '''
+
+        # A perfect square would never give (D/n) = -1
+        if math.isqrt(n) ** 2 == n:
             return False
-        r = int(n ** 0.5)
-        d = 5
-        while d <= r:
-            if n % d == 0:
-                return False
-            if n % (d + 2) == 0:
+
+        D = 5
+        while True:
+            jacobi = self.__jacobi_symbol(D, n)
+            if jacobi == -1:
+                break
+            if jacobi == 0 and abs(D) != n:
                 return False
-            d += 6
-        return True
+            D = -D - 2 if D > 0 else -D + 2
+        P = 1
+        Q = (1 - D) // 4
+
+        d = n + 1
+        s = 0
+        while d % 2 == 0:
+            d >>= 1
+            s += 1
+
+        def half(x):
+            # Division by 2 modulo an odd n
+            x %= n
+            if x & 1:
+                x += n
+            return x >> 1
+
+        # Left-to-right binary computation of U_d, V_d and Q^d
+        U = 1
+        V = P
+        Q_k = Q % n
+        for bit in bin(d)[3:]:
+            U = U * V % n
+            V = (V * V - 2 * Q_k) % n
+            Q_k = Q_k * Q_k % n
+            if bit == "1":
+                U, V = half(P * U + V), half(D * U + P * V)
+                Q_k = Q_k * Q % n
+
+        if U == 0 or V == 0:
+            return True
+        for r in range(1, s):
+            V = (V * V - 2 * Q_k) % n
+            if V == 0:
+                return True
+            Q_k = Q_k * Q_k % n
+        return False
+
+    def __jacobi_symbol(self, a, n):
+        '''
+        This method returns the Jacobi symbol (a/n) for an odd positive n.
+        '''
+
+        a %= n
+        result = 1
+        while a != 0:
+            while a % 2 == 0:
+                a >>= 1
+                if n % 8 == 3 or n % 8 == 5:
+                    result = -result
+            a, n = n, a
+            if a % 4 == 3 and n % 4 == 3:
+                result = -result
+            a %= n
+        return result if n == 1 else 0
 
     def __extended_gcd(self, a ,b):
         '''
@@ -192,24 +737,92 @@ class MathModule:
         y = x_1
         return gcd, x, y
 
-    def __load_first_few_hundred_primes(self, primes_count):
-        primes = list()
-        n_primes = 0
-        n = 1
-        while n_primes < primes_count:
-            if self.__is_prime(n):
-                n_primes += 1
-                primes.append(n)
-            n += 1
-        return primes
+    def __get_first_primes(self):
+        '''
+        This method returns the list of the first few hundred primes,
+        which are sieved when the list is needed for the first time.
+        '''
+
+        if self.__first_primes is None:
+            limit = self.__estimate_nth_prime_bound(self.__first_primes_count)
+            self.__first_primes = self.__sieve_primes(limit)[:self.__first_primes_count]
+        return self.__first_primes
+
+    def __get_first_primes_product(self):
+        if self.__first_primes_product is None:
+            self.__first_primes_product = math.prod(self.__get_first_primes())
+        return self.__first_primes_product
+
+    def __estimate_nth_prime_bound(self, n):
+        '''
+        This method returns an upper bound of the n-th prime number:
+        p_n < n * (ln(n) + ln(ln(n))) for n >= 6 (Rosser's theorem).
+        '''
+
+        if n < 6:
+            return 15
+        return int(n * (math.log(n) + math.log(math.log(n)))) + 1
+
+    def __sieve_primes(self, limit):
+        '''
+        This method returns a list of all primes smaller than the limit
+        using the Sieve of Eratosthenes.
+        '''
+
+        sieve = bytearray([1]) * limit
+        sieve[0:2] = bytes(min(2, limit))
+        for i in range(2, math.isqrt(limit - 1) + 1):
+            if sieve[i]:
+                sieve[i * i::i] = bytes(len(range(i * i, limit, i)))
+        return list(itertools.compress(range(limit), sieve))
+
+    def __segmented_sieve(self, limit):
+        '''
+        This generator yields lists of consecutive primes smaller than
+        the limit using the segmented Sieve of Eratosthenes. Only the
+        primes up to sqrt(limit) and a single segment are kept in memory.
+        '''
+
+        base_primes = self.__sieve_primes(math.isqrt(limit) + 1)
+        for low in range(0, limit, self.__sieve_segment_size):
+            high = min(low + self.__sieve_segment_size, limit)
+            segment = bytearray([1]) * (high - low)
+            if low == 0:
+                segment[0:2] = bytes(min(2, high))
+            for prime in base_primes:
+                if prime * prime >= high:
+                    break
+                # First multiple of the prime in the segment (not smaller than prime^2)
+                start = max(prime * prime, -(-low // prime) * prime) - low
+                segment[start::prime] = bytes(len(range(start, high - low, prime)))
+            yield list(itertools.compress(range(low, high), segment))
+
+    def __count_lines(self, filename):
+        '''
+        This method counts the lines of a file reading it in chunks.
+        '''
+
+        lines_count = 0
+        file = open(filename, "rb")
+        chunk = file.read(2 ** 20)
+        while chunk:
+            lines_count += chunk.count(b"\n")
+            chunk = file.read(2 ** 20)
+        file.close()
+        return lines_count
 
     def __generate_primes_file(self):
         '''
         This method creates a file which contains
         pre-generated prime numbers, whose quantity
         is denoted by the __generated_primes_count field.
+        The primes are found with the segmented Sieve of Eratosthenes
+        and written segment by segment.
         '''
 
+        if self.__primes_file_checked:
+            return
+
         # Check whether the data directory exists
         if not os.path.isdir(self.__data_directory):
             os.mkdir(self.__data_directory)
@@ -219,23 +832,22 @@ class MathModule:
         # Check whether the file already exists and has at least the chosen amount of prime numbers
         # If the file has more lines than the chosen number of primes to generate than we skip
         # generating the same file with fewer prime numbers.
-        if os.path.isfile(filename):
-            file = open(filename, "r")
-            lines = file.read().splitlines()
-            if len(lines) >= self.__generated_primes_count:
-                file.close()
-                return
-            file.close()
+        if os.path.isfile(filename) and self.__count_lines(filename) >= self.__generated_primes_count:
+            self.__primes_file_checked = True
+            return
 
         # Generating prime numbers and saving them in a file
         print("[INFO] Generating a file with", self.__generated_primes_count, "prime numbers.")
         file = open(filename, "w")
         n_primes = 0
-        n = 1
-        while n_primes < self.__generated_primes_count:
-            if self.__is_prime(n):
-                n_primes += 1
-                file.write(str(n) + "\n")
-            n += 1
+        limit = self.__estimate_nth_prime_bound(self.__generated_primes_count)
+        for primes in self.__segmented_sieve(limit):
+            primes = primes[:self.__generated_primes_count - n_primes]
+            if len(primes) > 0:
+                file.write("\n".join(map(str, primes)) + "\n")
+            n_primes += len(primes)
+            if n_primes >= self.__generated_primes_count:
+                break
         file.close()
-        print("[INFO] Generation complete.")
\ No newline at end of file
+        self.__primes_file_checked = True
+        print("[INFO] Generation complete.")
@@ -0,0 +1,209 @@
+import io
+import math
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+# Phases reported by the EncryptionModule
+KEY_LOAD = "key_load"
+BLOCK_PACKING = "block_packing"
+MODEXP = "modexp"
+SERIALIZATION = "serialization"
+KEY_GENERATION = "key_generation"
+SESSION_CIPHER = "session_cipher"
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class _TimedPhase:
+    def __init__(self, metrics, name):
+        self.__metrics = metrics
+        self.__name = name
+        self.__start_time = 0.0
+
+    def __enter__(self):
+        self.__metrics._phase_started(self.__name)
+        self.__start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.__start_time
+        self.__metrics._phase_finished(self.__name, elapsed)
+        return False
+
+class NullMetrics:
+    '''
+    Metrics collector that records nothing - the default one, so that
+    the instrumentation costs next to nothing when it is not used.
+    Every collector provides:
+    - phase(name): a context manager timing one run of a phase,
+    - count(name, value): adding a value to a counter.
+    '''
+
+    __null_phase = _NullPhase()
+
+    def phase(self, name):
+        return self.__null_phase
+
+    def count(self, name, value = 1):
+        pass
+
+class HistogramMetrics(NullMetrics):
+    '''
+    Metrics collector keeping, for every phase, the number of runs, the total,
+    minimum and maximum time and a histogram of the run times with buckets
+    being powers of two microseconds. It also keeps the counters.
+    '''
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__phases = dict()
+        self.__counters = dict()
+
+    def phase(self, name):
+        return _TimedPhase(self, name)
+
+    def count(self, name, value = 1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def record(self, name, elapsed):
+        '''
+        This method adds one run of a phase, which took elapsed seconds.
+        '''
+
+        bucket = 0
+        if elapsed > 1e-6:
+            bucket = math.ceil(math.log2(elapsed * 1e6))
+        with self.__lock:
+            phase = self.__phases.get(name)
+            if phase is None:
+                phase = {"count": 0, "total": 0.0, "min": elapsed, "max": elapsed, "histogram": dict()}
+                self.__phases[name] = phase
+            phase["count"] += 1
+            phase["total"] += elapsed
+            phase["min"] = min(phase["min"], elapsed)
+            phase["max"] = max(phase["max"], elapsed)
+            phase["histogram"][bucket] = phase["histogram"].get(bucket, 0) + 1
+
+    def get_phase(self, name):
+        '''
+        This method returns the statistics of a phase (None if it has not run):
+        count, total, min, max and mean time in seconds, and the histogram
+        mapping the upper bound of every bucket (in microseconds) to the
+        number of runs.
+        '''
+
+        with self.__lock:
+            phase = self.__phases.get(name)
+            if phase is None:
+                return None
+            return {
+                "count": phase["count"],
+                "total": phase["total"],
+                "min": phase["min"],
+                "max": phase["max"],
+                "mean": phase["total"] / phase["count"],
+                "histogram": {2 ** bucket: runs for bucket, runs in sorted(phase["histogram"].items())}
+            }
+
+    def get_counters(self):
+        with self.__lock:
+            return dict(self.__counters)
+
+    def get_summary(self):
+        with self.__lock:
+            names = list(self.__phases)
+        return {
+            "phases": {name: self.get_phase(name) for name in names},
+            "counters": self.get_counters()
+        }
+
+    def reset(self):
+        with self.__lock:
+            self.__phases.clear()
+            self.__counters.clear()
+
+    def format_summary(self):
+        '''
+        This method returns the summary as a human readable table.
+        '''
+
+        lines = list()
+        for name, phase in self.get_summary()["phases"].items():
+            lines.append("%-16s %8d runs  total %.6f s  mean %.6f s  max %.6f s" % (name, phase["count"], phase["total"], phase["mean"], phase["max"]))
+        for name, value in self.get_counters().items():
+            lines.append("%-16s %8d" % (name, value))
+        return "\n".join(lines)
+
+    def _phase_started(self, name):
+        pass
+
+    def _phase_finished(self, name, elapsed):
+        self.record(name, elapsed)
+
+class ProfilingMetrics(HistogramMetrics):
+    '''
+    Histogram collector which additionally runs cProfile while any phase is
+    running (profile = True) and records the peak memory allocated during
+    every phase with tracemalloc (trace_memory = True). Both are expensive,
+    so this collector is meant for investigations, not for production.
+    '''
+
+    def __init__(self, profile = True, trace_memory = True):
+        super().__init__()
+        self.__profiler = cProfile.Profile() if profile else None
+        self.__trace_memory = trace_memory
+        self.__active_phases = 0
+        self.__memory_peaks = dict()
+        self.__profiling_lock = threading.Lock()
+
+    def get_profile_stats(self, sort = "cumulative", limit = 20):
+        '''
+        This method returns the cProfile statistics of the phases as text.
+        '''
+
+        if self.__profiler is None:
+            return ""
+        stream = io.StringIO()
+        with self.__profiling_lock:
+            stats = pstats.Stats(self.__profiler, stream = stream)
+            stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def get_memory_peaks(self):
+        '''
+        This method returns the largest peak of memory (in bytes) allocated
+        during a single run of every phase.
+        '''
+
+        with self.__profiling_lock:
+            return dict(self.__memory_peaks)
+
+    def _phase_started(self, name):
+        with self.__profiling_lock:
+            self.__active_phases += 1
+            if self.__active_phases > 1:
+                return
+            if self.__trace_memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+            if self.__profiler is not None:
+                self.__profiler.enable()
+
+    def _phase_finished(self, name, elapsed):
+        with self.__profiling_lock:
+            self.__active_phases -= 1
+            if self.__trace_memory and tracemalloc.is_tracing():
+                peak = tracemalloc.get_traced_memory()[1]
+                self.__memory_peaks[name] = max(self.__memory_peaks.get(name, 0), peak)
+            if self.__active_phases == 0 and self.__profiler is not None:
+                self.__profiler.disable()
+        super()._phase_finished(name, elapsed)
@@ -0,0 +1,80 @@
+# PyCryptodome is needed only by the hybrid mode
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+class SessionCipher:
+    '''
+    Authenticated symmetric cipher encrypting the payload of the hybrid mode
+    with a random session key: AES-256 in GCM mode (from PyCryptodome).
+    The data can be encrypted or decrypted in any number of parts. The
+    associated data (the ciphertext header) is authenticated, but not encrypted.
+    '''
+
+    AES_GCM = "aes-256-gcm"
+    CIPHERS = [AES_GCM]     # the index of the cipher is written in the ciphertext header
+    KEY_LENGTH = 32
+    TAG_LENGTH = 16
+
+    __NONCE_LENGTHS = {AES_GCM: 12}
+
+    @staticmethod
+    def is_available(cipher):
+        return cipher == SessionCipher.AES_GCM and AES is not None
+
+    @staticmethod
+    def get_default_cipher():
+        return SessionCipher.AES_GCM
+
+    @staticmethod
+    def get_nonce_length(cipher):
+        return SessionCipher.__NONCE_LENGTHS[cipher]
+
+    @staticmethod
+    def check_available(cipher):
+        '''
+        This method raises a ValueError if the cipher is unknown
+        or PyCryptodome is not installed.
+        '''
+
+        if cipher not in SessionCipher.CIPHERS:
+            raise ValueError("Unknown session cipher: " + str(cipher))
+        if not SessionCipher.is_available(cipher):
+            raise ValueError("The hybrid mode needs PyCryptodome to be installed (for AES-256-GCM).")
+
+    def __init__(self, cipher, key, nonce, associated_data = b""):
+        self.check_available(cipher)
+        if len(key) != self.KEY_LENGTH or len(nonce) != self.get_nonce_length(cipher):
+            raise ValueError("Invalid length of the session key or the nonce.")
+
+        self.__cipher = cipher
+        self.__aes = AES.new(key, AES.MODE_GCM, nonce = nonce, mac_len = self.TAG_LENGTH)
+        self.__aes.update(associated_data)
+
+    def get_cipher(self):
+        return self.__cipher
+
+    def encrypt(self, data):
+        return self.__aes.encrypt(data)
+
+    def decrypt(self, data):
+        return self.__aes.decrypt(data)
+
+    def get_tag(self):
+        '''
+        This method returns the authentication tag of the encrypted data.
+        '''
+
+        return self.__aes.digest()
+
+    def verify(self, tag):
+        '''
+        This method raises a ValueError if the decrypted data
+        or the associated data do not match the tag.
+        '''
+
+        try:
+            self.__aes.verify(tag)
+        except ValueError:
+            raise ValueError("Ciphertext failed the authentication.")
@@ -0,0 +1,104 @@
+import multiprocessing
+
+from .math_module import MathModule
+
+# Keys and arithmetic backend of the worker process, set once by the pool initializer
+_public_key = None
+_private_key = None
+_backend = None
+
+def _initialize_worker(public_key, private_key, backend):
+    global _public_key, _private_key, _backend
+    _public_key = public_key
+    _private_key = private_key
+    _backend = backend
+
+def _get_context():
+    '''
+    Returns the multiprocessing context of the pool. The pool may be created
+    from any thread (a GUI worker thread, an executor thread), and forking
+    a process with several threads can deadlock, so the workers are started
+    by a fork server (or spawned where there is none) instead.
+    '''
+
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def _encrypt_chunk(chunk):
+    n, e = _public_key
+    powmod = MathModule.get_powmod(_backend)
+    return [powmod(block, e, n) for block in chunk]
+
+def _decrypt_chunk(chunk):
+    return [MathModule.private_pow(block, _private_key, _backend) for block in chunk]
+
+class WorkerPool:
+    '''
+    A pool of worker processes exponentiating lists of blocks in parallel.
+    The keys are sent to every worker only once, when it is started,
+    and the pool is meant to be reused by subsequent calls. The workers
+    are started by a fork server, which imports the main module.
+    '''
+
+    def __init__(self, workers, public_key, private_key, backend = None):
+        self.__workers = workers
+        self.__public_key = public_key
+        self.__private_key = private_key
+        self.__chunks_per_worker = 4
+        self.__pool = _get_context().Pool(
+            processes = workers,
+            initializer = _initialize_worker,
+            initargs = (public_key, private_key, backend)
+        )
+
+    def get_workers(self):
+        return self.__workers
+
+    def has_keys(self, public_key, private_key):
+        return self.__public_key is public_key and self.__private_key is private_key
+
+    def encrypt(self, blocks, progress = None):
+        '''
+        This method returns the list of block values taken to power of e
+        modulo n, in the same order as the given blocks. The optional
+        progress callback is called with the size of every finished chunk.
+        '''
+
+        return self.__map(_encrypt_chunk, blocks, progress)
+
+    def decrypt(self, blocks, progress = None):
+        '''
+        This method returns the list of block values taken to power of d
+        modulo n, in the same order as the given blocks. The optional
+        progress callback is called with the size of every finished chunk.
+        '''
+
+        return self.__map(_decrypt_chunk, blocks, progress)
+
+    def close(self):
+        self.__pool.terminate()
+        self.__pool.join()
+
+    def __map(self, function, blocks, progress):
+        '''
+        This method splits the blocks into chunks (a few per worker, so that
+        the work is balanced), processes the chunks in the worker processes
+        and joins the results keeping the order of the blocks.
+        '''
+
+        chunk_count = self.__workers * self.__chunks_per_worker
+        chunk_size = max(1, -(-len(blocks) // chunk_count))
+        chunks = [blocks[i:i + chunk_size] for i in range(0, len(blocks), chunk_size)]
+        result = list()
+        if progress is None:
+            for chunk in self.__pool.map(function, chunks):
+                result.extend(chunk)
+            return result
+
+        # The results are collected as the chunks finish, so that the
+        # progress can be reported (and the operation cancelled) in between
+        for chunk in self.__pool.imap(function, chunks):
+            result.extend(chunk)
+            progress(len(chunk))
+        return result
@@ -1,15 +1,46 @@
-from encryption_module.encryption_module import EncryptionModule
+from encryption_module.encryption_module import EncryptionModule, OperationCancelledError
+from encryption_module.metrics import HistogramMetrics
 
 import tkinter as tk
 from tkinter import ttk
+from tkinter import filedialog
 
-import time
+import os
+import queue
+import shutil
+import tempfile
+import threading
 
 class MessageEncoderGUI:
     def __init__(self):
         self.__em = EncryptionModule(mode = "ECB", generate_new_keys = False )
+        self.__em.set_output_format("armored")
+        self.__em.set_parallel_prime_search((os.cpu_count() or 1) > 1)
+        self.__key_pool_size = 2   # the pool is started on the first generation of keys
+        self.__metrics = HistogramMetrics()
+        self.__em.set_metrics(self.__metrics)
+
+        # Encryption, decryption and key generation run in a worker thread,
+        # which reports back through the queue polled by the Tk main loop
+        self.__task_thread = None
+        self.__task_queue = queue.Queue()
+        self.__cancel_event = threading.Event()
+        self.__poll_interval = 50  # milliseconds
+
+        # Large messages and ciphertexts are kept out of the text widgets:
+        # files are streamed through the EncryptionModule into temporary
+        # files and the widgets show only a preview of their contents
+        self.__preview_length = 65536  # characters
+        self.__insert_chunk_length = 4096  # characters inserted at once
+        self.__pending_inserts = dict()  # widget -> id of the scheduled insert
+        self.__temporary_directory = tempfile.mkdtemp(prefix = "rsa_message_encoder_")
+        self.__message_file = None
+        self.__ciphertext = None
+        self.__ciphertext_file = None
+        self.__decrypted_file = None
 
         # GUI parameters
+        self.__modes = ["ECB", "CBC", "HYBRID"]
         self.__padx = 8
         self.__pady = 8
         self.__button_color = "#538f39"
@@ -56,16 +87,13 @@ class MessageEncoderGUI:
   
         self.__cbx_mode = tk.ttk.Combobox(
             master = self.__frm_main,
-            values = ["ECB", "CBC"],
-            height = 2,
+            values = self.__modes,
+            height = 3,
             width = 7,
             state = "readonly"
         )
         self.__cbx_mode.grid(sticky = "w", column = 1, row = 1, padx = self.__padx, pady = self.__pady)
-        if self.__em.get_mode() == "ECB":
-            self.__cbx_mode.current(0)
-        else:
-            self.__cbx_mode.current(1)
+        self.__cbx_mode.current(self.__modes.index(self.__em.get_mode()))
         self.__cbx_mode.bind("<<ComboboxSelected>>", self.__cbx_mode_on_selected)
         #--------------------------------------------        
 
@@ -143,8 +171,21 @@ class MessageEncoderGUI:
             fg = "black",
             activebackground = self.__button_hover_color
         )
-        self.__btn_encrypt.grid(column = 2, row = 4, padx = self.__padx, pady = self.__pady)
+        self.__btn_encrypt.grid(sticky = "n", column = 2, row = 4, padx = self.__padx, pady = self.__pady)
         self.__btn_encrypt.bind("<ButtonRelease-1>", self.__btn_encrypt_on_release)   
+
+        self.__btn_open_file = tk.Button(
+            master = self.__frm_main,
+            relief = tk.GROOVE,
+            text = "Open file...",
+            width = 10,
+            height = 1,
+            bg = self.__button_color,
+            fg = "black",
+            activebackground = self.__button_hover_color
+        )
+        self.__btn_open_file.grid(sticky = "s", column = 2, row = 4, padx = self.__padx, pady = self.__pady)
+        self.__btn_open_file.bind("<ButtonRelease-1>", self.__btn_open_file_on_release)
         #--------------------------------------------        
 
         #-------------------CIPHER-------------------        
@@ -181,8 +222,21 @@ class MessageEncoderGUI:
             fg = "black",
             activebackground = self.__button_hover_color
         )
-        self.__btn_decrypt.grid(column = 2, row = 5, padx = self.__padx, pady = self.__pady)
+        self.__btn_decrypt.grid(sticky = "n", column = 2, row = 5, padx = self.__padx, pady = self.__pady)
         self.__btn_decrypt.bind("<ButtonRelease-1>", self.__btn_decrypt_on_release)    
+
+        self.__btn_save_ciphertext = tk.Button(
+            master = self.__frm_main,
+            relief = tk.GROOVE,
+            text = "Save ciphertext...",
+            width = 14,
+            height = 1,
+            bg = self.__button_color,
+            fg = "black",
+            activebackground = self.__button_hover_color
+        )
+        self.__btn_save_ciphertext.grid(sticky = "s", column = 2, row = 5, padx = self.__padx, pady = self.__pady)
+        self.__btn_save_ciphertext.bind("<ButtonRelease-1>", self.__btn_save_ciphertext_on_release)
         #--------------------------------------------        
 
         #-----------------DECRYPTED------------------        
@@ -223,6 +277,42 @@ class MessageEncoderGUI:
         self.__btn_clear.grid(column = 2, row = 6, padx = self.__padx, pady = self.__pady)   
         self.__btn_clear.bind("<ButtonRelease-1>", self.__btn_clear_click)
 
+        #------------------PROGRESS------------------
+        self.__lbl_progress = tk.Label(
+            master = self.__frm_main,
+            relief = tk.FLAT,
+            text = "",
+            width = 15,
+            height = 1,
+            bg = self.__bg_color,
+            fg = "black",
+            font = self.__label_font
+        )
+        self.__lbl_progress.grid(column = 0, row = 7, padx = self.__padx, pady = self.__pady)
+
+        self.__pgb_progress = ttk.Progressbar(
+            master = self.__frm_main,
+            orient = tk.HORIZONTAL,
+            length = 600,
+            mode = "determinate"
+        )
+        self.__pgb_progress.grid(column = 1, row = 7, padx = self.__padx, pady = self.__pady)
+
+        self.__btn_cancel = tk.Button(
+            master = self.__frm_main,
+            relief = tk.GROOVE,
+            text = "Cancel",
+            width = 10,
+            height = 1,
+            bg = self.__button_color,
+            fg = "black",
+            activebackground = self.__button_hover_color,
+            state = "disabled"
+        )
+        self.__btn_cancel.grid(column = 2, row = 7, padx = self.__padx, pady = self.__pady)
+        self.__btn_cancel.bind("<ButtonRelease-1>", self.__btn_cancel_on_release)
+        #--------------------------------------------
+
         self.__btn_exit = tk.Button(
             master = self.__frm_main,
             relief = tk.GROOVE,
@@ -233,17 +323,29 @@ class MessageEncoderGUI:
             fg = "black",
             activebackground = self.__button_hover_color
         )
-        self.__btn_exit.grid(column = 1, row = 7, padx = self.__padx, pady = self.__pady)   
+        self.__btn_exit.grid(column = 1, row = 8, padx = self.__padx, pady = self.__pady)   
         self.__btn_exit.bind("<ButtonRelease-1>", self.__exit_button_click)
 
     def __cbx_mode_on_selected(self, event):
         selected_mode = self.__cbx_mode.get()
         if selected_mode == self.__em.get_mode():
             return
-        self.__em.set_mode(selected_mode)
+        if self.__is_busy():
+            self.__cbx_mode.current(self.__modes.index(self.__em.get_mode()))
+            return
+        try:
+            self.__em.set_mode(selected_mode)
+        except ValueError as error:
+            print("[ERROR]", error)
+            self.__cbx_mode.current(self.__modes.index(self.__em.get_mode()))
+            return
         print("[INFO] Using", selected_mode, "mode.")
 
     def __ent_block_size_on_set(self, event):
+        if self.__is_busy():
+            self.__ent_block_size.delete(0, tk.END)
+            self.__ent_block_size.insert(0, str(self.__em.get_block_size()))
+            return
         if not self.__ent_block_size.get().isdecimal():
             self.__ent_block_size.delete(0, tk.END)
             self.__ent_block_size.insert(0, "1")
@@ -253,72 +355,314 @@ class MessageEncoderGUI:
 
         if block_size == self.__em.get_block_size():
             return
-        self.__em.set_block_size(int(block_size))
+        try:
+            self.__em.set_block_size(int(block_size))
+        except ValueError as error:
+            print("[ERROR]", error)
+            self.__ent_block_size.delete(0, tk.END)
+            self.__ent_block_size.insert(0, str(self.__em.get_block_size()))
+            return
         print("[INFO] Using", block_size, "byte blocks.")
 
     def __btn_generate_keys_on_release(self, event):
-        start_time = time.time()
-        self.__em.generate_pair_of_keys()
-        finish_time = time.time()
-        print("KEY GENERATION: ", finish_time - start_time, "seconds")
+        if self.__is_busy():
+            return
+        # The generation of keys reports no progress and cannot be cancelled
+        self.__start_task("Generating keys", lambda progress: self.__rotate_keys(), lambda result: None, cancellable = False)
+
+    def __rotate_keys(self):
+        '''
+        This method replaces the keys. The first pair is generated right away
+        and only then the pool of keys is started, so that the next pairs are
+        ready in advance, but nothing is generated in the background (or
+        spooled to the data directory) unless keys were requested.
+        '''
+
+        self.__em.rotate_keys()
+        if self.__em.get_key_pool_stats() is None:
+            self.__em.start_key_pool(size = self.__key_pool_size)
+
+    def __btn_open_file_on_release(self, event):
+        if self.__is_busy():
+            return
+        filename = filedialog.askopenfilename(title = "Open file")
+        if not filename:
+            return
+
+        # The file is encrypted straight from the disk, the message box
+        # shows only its beginning
+        self.__message_file = filename
+        file = open(filename, "rb")
+        preview = file.read(self.__preview_length).decode("utf-8", errors = "replace")
+        file.close()
+        self.__show_preview(self.__txt_message, preview, os.path.getsize(filename), os.path.basename(filename))
+        print("[INFO] Opened", filename)
 
     def __btn_encrypt_on_release(self, event):
+        if self.__is_busy():
+            return
+        if self.__message_file is not None:
+            filename = self.__message_file
+            self.__start_task("Encrypting", lambda progress: self.__encrypt_file(filename, progress), self.__show_ciphertext_file)
+            return
+
         message = self.__txt_message.get("1.0", tk.END)
         message.strip()
         message = message[:-1]
         if message == "":
-            self.__txt_cipher.configure(state = "normal")
-            self.__txt_cipher.delete("1.0", tk.END)
-            self.__txt_cipher.configure(state = "disabled")
-            self.__txt_decrypted.configure(state = "normal")
-            self.__txt_decrypted.delete("1.0", tk.END)
-            self.__txt_decrypted.configure(state = "disabled")
+            self.__clear_ciphertext()
+            self.__clear_decrypted_message()
             return
-        print("*----------ENCRYPTION----------*")
-        start_time = time.time()
-        ciphertext = self.__em.encrypt(message)
-        finish_time = time.time()
-        print("Message:", message)
-        print("Encryption time: ", finish_time - start_time, "seconds")
-        print("*------------------------------*")
-
-        print("***  MESSAGE LENGTH:", len(message))
-        print("***  CIPHERTEXT LENGTH:", len(ciphertext))
-
-        # print("Ciphertext:", ciphertext)
-        self.__txt_cipher.configure(state = "normal")
-        self.__txt_cipher.delete("1.0", tk.END)
-        self.__txt_cipher.insert("1.0", ciphertext)
-        self.__txt_cipher.configure(state = "disabled")
+        self.__start_task("Encrypting", lambda progress: self.__em.encrypt(message, progress), self.__show_ciphertext)
+
+    def __encrypt_file(self, filename, progress):
+        '''
+        This method encrypts a file into a temporary file with the binary
+        ciphertext, reporting the progress by the number of bytes read.
+        It runs in the worker thread.
+        '''
+
+        size = os.path.getsize(filename)
+        ciphertext_file = self.__create_temporary_file(".rsam")
+        try:
+            with open(filename, "rb") as reader, open(ciphertext_file, "wb") as writer:
+                self.__em.encrypt_stream(reader, writer, lambda done, total: progress(reader.tell(), size))
+        except BaseException:
+            os.remove(ciphertext_file)
+            raise
+        return ciphertext_file
+
+    def __show_ciphertext(self, ciphertext):
+        self.__clear_ciphertext()
+        self.__clear_decrypted_message()
+        self.__ciphertext = ciphertext
+        self.__show_preview(self.__txt_cipher, ciphertext[:self.__preview_length], len(ciphertext))
+
+    def __show_ciphertext_file(self, ciphertext_file):
+        self.__clear_ciphertext()
+        self.__clear_decrypted_message()
+        self.__ciphertext_file = ciphertext_file
+        file = open(ciphertext_file, "rb")
+        preview = file.read(self.__preview_length // 2).hex()
+        file.close()
+        self.__show_preview(self.__txt_cipher, preview, os.path.getsize(ciphertext_file), "binary ciphertext")
 
     def __btn_decrypt_on_release(self, event):
-        ciphertext = self.__txt_cipher.get("1.0", tk.END)
-        ciphertext.strip()
-        ciphertext = ciphertext[:-1]
-        if ciphertext == "":
+        if self.__is_busy():
+            return
+        if self.__ciphertext_file is not None:
+            ciphertext_file = self.__ciphertext_file
+            self.__start_task("Decrypting", lambda progress: self.__decrypt_file(ciphertext_file, progress), self.__show_decrypted_file)
+        elif self.__ciphertext is not None:
+            ciphertext = self.__ciphertext
+            self.__start_task("Decrypting", lambda progress: self.__em.decrypt(ciphertext, progress), self.__show_decrypted_message)
+
+    def __decrypt_file(self, ciphertext_file, progress):
+        size = os.path.getsize(ciphertext_file)
+        decrypted_file = self.__create_temporary_file(".txt")
+        try:
+            with open(ciphertext_file, "rb") as reader, open(decrypted_file, "wb") as writer:
+                self.__em.decrypt_stream(reader, writer, lambda done, total: progress(reader.tell(), size))
+        except BaseException:
+            os.remove(decrypted_file)
+            raise
+        return decrypted_file
+
+    def __show_decrypted_message(self, decrypted_message):
+        decrypted_message = str(decrypted_message)
+        self.__clear_decrypted_message()
+        self.__show_preview(self.__txt_decrypted, decrypted_message[:self.__preview_length], len(decrypted_message))
+
+    def __show_decrypted_file(self, decrypted_file):
+        self.__clear_decrypted_message()
+        self.__decrypted_file = decrypted_file
+        file = open(decrypted_file, "rb")
+        preview = file.read(self.__preview_length).decode("utf-8", errors = "replace")
+        file.close()
+        self.__show_preview(self.__txt_decrypted, preview, os.path.getsize(decrypted_file), "decrypted file")
+
+    def __btn_save_ciphertext_on_release(self, event):
+        if self.__is_busy():
+            return
+        if self.__ciphertext is None and self.__ciphertext_file is None:
+            return
+        extension = ".rsam" if self.__ciphertext_file is not None else ".txt"
+        filename = filedialog.asksaveasfilename(title = "Save ciphertext", defaultextension = extension)
+        if not filename:
             return
-        print("*----------DECRYPTION----------*")
-        start_time = time.time()
-        decrypted_message = str(self.__em.decrypt(ciphertext))
-        finish_time = time.time()
-        print("Decrypted message:", decrypted_message)
-        print("Decryption time: ", finish_time - start_time, "seconds")
-        print("*------------------------------*")
-        self.__txt_decrypted.configure(state = "normal")
-        self.__txt_decrypted.delete("1.0", tk.END)
-        self.__txt_decrypted.insert("1.0", decrypted_message)
-        self.__txt_decrypted.configure(state = "disabled")
+
+        if self.__ciphertext_file is not None:
+            ciphertext_file = self.__ciphertext_file
+            self.__start_task("Saving", lambda progress: shutil.copyfile(ciphertext_file, filename), lambda result: None, cancellable = False)
+        else:
+            file = open(filename, "w")
+            file.write(self.__ciphertext)
+            file.close()
+        print("[INFO] Ciphertext saved to", filename)
 
     def __btn_clear_click(self, event):
-        self.__txt_cipher.configure(state = "normal")
-        self.__txt_cipher.delete("1.0", tk.END)
-        self.__txt_cipher.configure(state = "disabled")
-        self.__txt_decrypted.configure(state = "normal")
-        self.__txt_decrypted.delete("1.0", tk.END)
-        self.__txt_decrypted.configure(state = "disabled")
+        if self.__is_busy():
+            return
+        self.__clear_ciphertext()
+        self.__clear_decrypted_message()
+        if self.__message_file is not None:
+            # Give the message box back to the user
+            self.__message_file = None
+            self.__set_text(self.__txt_message, "")
+            self.__txt_message.configure(state = "normal")
+
+    def __clear_ciphertext(self):
+        self.__ciphertext = None
+        if self.__ciphertext_file is not None:
+            os.remove(self.__ciphertext_file)
+            self.__ciphertext_file = None
+        self.__set_text(self.__txt_cipher, "")
+
+    def __clear_decrypted_message(self):
+        if self.__decrypted_file is not None:
+            os.remove(self.__decrypted_file)
+            self.__decrypted_file = None
+        self.__set_text(self.__txt_decrypted, "")
+
+    def __create_temporary_file(self, suffix):
+        descriptor, filename = tempfile.mkstemp(suffix = suffix, dir = self.__temporary_directory)
+        os.close(descriptor)
+        return filename
+
+    def __show_preview(self, widget, preview, size, name = None):
+        '''
+        This method shows the preview of a message or a ciphertext followed,
+        if the preview is not the whole of it, by a note with its size.
+        The widget is left read-only.
+        '''
+
+        text = preview
+        if len(preview) < size or name is not None:
+            description = self.__format_size(size) if name is None else name + ", " + self.__format_size(size)
+            text += "\n\n[... " + description + "]"
+        self.__set_text(widget, text)
+
+    def __format_size(self, size):
+        for unit in ["B", "KB", "MB"]:
+            if size < 1024:
+                return "%d %s" % (size, unit) if unit == "B" else "%.1f %s" % (size, unit)
+            size /= 1024
+        return "%.1f GB" % size
+
+    def __set_text(self, widget, text):
+        '''
+        This method replaces the text of a read-only widget. Long texts are
+        inserted in chunks from the main loop, so the window keeps
+        responding while they are rendered.
+        '''
+
+        pending_insert = self.__pending_inserts.pop(widget, None)
+        if pending_insert is not None:
+            self.__window.after_cancel(pending_insert)
+        widget.configure(state = "normal")
+        widget.delete("1.0", tk.END)
+        widget.configure(state = "disabled")
+        self.__insert_text_chunk(widget, text, 0)
+
+    def __insert_text_chunk(self, widget, text, position):
+        self.__pending_inserts.pop(widget, None)
+        if position >= len(text):
+            return
+        widget.configure(state = "normal")
+        widget.insert(tk.END, text[position:position + self.__insert_chunk_length])
+        widget.configure(state = "disabled")
+        position += self.__insert_chunk_length
+        if position < len(text):
+            self.__pending_inserts[widget] = self.__window.after(1, self.__insert_text_chunk, widget, text, position)
+
+    def __btn_cancel_on_release(self, event):
+        if self.__is_busy():
+            self.__cancel_event.set()
+
+    def __is_busy(self):
+        return self.__task_thread is not None
+
+    def __start_task(self, name, task, on_finished, cancellable = True):
+        '''
+        This method runs task(progress) in a worker thread and passes its
+        result to on_finished in the main thread. The progress callback
+        given to the task queues the progress for the progress bar and
+        cancels the task (by raising OperationCancelledError) once the
+        Cancel button was pressed.
+        '''
+
+        self.__cancel_event.clear()
+        self.__lbl_progress.configure(text = name + "...")
+        self.__btn_cancel.configure(state = "normal" if cancellable else "disabled")
+        self.__pgb_progress.stop()
+        if cancellable:
+            self.__pgb_progress.configure(mode = "determinate", value = 0)
+        else:
+            self.__pgb_progress.configure(mode = "indeterminate")
+            self.__pgb_progress.start()
+
+        def progress(done, total):
+            if self.__cancel_event.is_set():
+                raise OperationCancelledError()
+            self.__task_queue.put(("progress", done, total))
+
+        def run():
+            try:
+                result = task(progress)
+            except OperationCancelledError:
+                self.__task_queue.put(("cancelled",))
+            except Exception as error:
+                self.__task_queue.put(("error", error))
+            else:
+                self.__task_queue.put(("finished", result))
+
+        self.__task_thread = threading.Thread(target = run, daemon = True)
+        self.__task_thread.start()
+        self.__window.after(self.__poll_interval, self.__poll_task, name, on_finished)
+
+    def __poll_task(self, name, on_finished):
+        '''
+        This method handles the messages queued by the running task and,
+        unless the task has ended, schedules itself again.
+        '''
+
+        while True:
+            try:
+                message = self.__task_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "progress":
+                done, total = message[1], message[2]
+                if total:
+                    self.__pgb_progress.configure(value = 100 * done / total)
+                    self.__lbl_progress.configure(text = "%s %d%%" % (name, 100 * done // total))
+                continue
+
+            self.__task_thread = None
+            self.__pgb_progress.stop()
+            self.__pgb_progress.configure(mode = "determinate", value = 0)
+            self.__btn_cancel.configure(state = "disabled")
+            self.__lbl_progress.configure(text = "")
+            if message[0] == "finished":
+                on_finished(message[1])
+            elif message[0] == "cancelled":
+                print("[INFO]", name, "cancelled.")
+            else:
+                print("[ERROR]", message[1])
+            return
+
+        self.__window.after(self.__poll_interval, self.__poll_task, name, on_finished)
 
     def __exit_button_click(self, event):
+        self.__cancel_event.set()
+        summary = self.__metrics.format_summary()
+        if summary:
+            print("[INFO] Time spent in every phase:")
+            print(summary)
+        self.__em.close()
         self.__window.destroy()
+        shutil.rmtree(self.__temporary_directory, ignore_errors = True)
 
     def run(self):
         self.__window.mainloop()